@@ -0,0 +1,87 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import join
+from typing import NamedTuple
+from struct import unpack_from
+import os, re, progressbar
+from helper_mssb_data import ArchiveDecompressor, DataEntry, byte_view, file_cache
+
+AD_GC_FORM = b'AdGCForm'
+AD_GC_FORM_PATTERN = re.compile(re.escape(AD_GC_FORM))
+
+class AdGCFormHeader(NamedTuple):
+    # the data starts right after the marker, the 8 bytes before it hold the sizes and bit counts
+    location:int
+    original_size:int
+    compression_flag:int
+    lookback_bit_size:int
+    repetition_bit_size:int
+
+def locate_ad_gc_forms(buffer:bytes) -> list[AdGCFormHeader]:
+    # every marker in one pass over the archive, no slices of it are made
+    data = byte_view(buffer)
+    headers = []
+    for match in AD_GC_FORM_PATTERN.finditer(data):
+        if match.start() < 8:
+            continue
+
+        original_size, compression_info = unpack_from('<II', data, match.start() - 8)
+        compression_flag = original_size >> 28
+        original_size &= 0xfffffff
+
+        if compression_flag == 0:
+            lookback_bit, repetition_bit = 0, 0
+        else:
+            lookback_bit = compression_info & 0xff
+            repetition_bit = (compression_info >> 8) & 0xff
+
+        headers.append(AdGCFormHeader(match.end(), original_size, compression_flag, lookback_bit, repetition_bit))
+    return headers
+
+def measure_shard(file_name:str, headers:list[AdGCFormHeader]) -> list[int]:
+    # runs in a worker process, compressed sizes of each form in the shard
+    buffer = file_cache.get_file_bytes(file_name)
+    return [ArchiveDecompressor(buffer, x.lookback_bit_size, x.repetition_bit_size, x.original_size, x.location).measure()[0] for x in headers]
+
+def measure_ad_gc_forms(file_name:str, headers:list[AdGCFormHeader], max_workers:int=None, shards_per_worker:int=4) -> list[int]:
+    # compressed size of every form, raw forms are their original size.
+    # progress is counted in decompressed bytes since a few large forms take most of the time
+    compressed_sizes = [x.original_size for x in headers]
+    to_measure = [i for i, x in enumerate(headers) if x.compression_flag != 0]
+    if len(to_measure) == 0:
+        return compressed_sizes
+
+    max_workers = max_workers or os.cpu_count() or 1
+    shard_count = min(len(to_measure), max_workers * shards_per_worker)
+    shards = [to_measure[i::shard_count] for i in range(shard_count)]
+
+    bar = progressbar.DataTransferBar(max_value=sum(headers[i].original_size for i in to_measure))
+    bar.start()
+    bytes_done = 0
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(measure_shard, file_name, [headers[i] for i in shard]): shard for shard in shards}
+
+        for future in as_completed(futures):
+            shard = futures[future]
+            for i, compressed_size in zip(shard, future.result()):
+                compressed_sizes[i] = compressed_size
+            bytes_done += sum(headers[i].original_size for i in shard)
+            bar.update(bytes_done)
+    bar.finish()
+
+    return compressed_sizes
+
+def find_ad_gc_forms(file_name:str, output_folder:str, max_workers:int=None) -> list[DataEntry]:
+    headers = locate_ad_gc_forms(file_cache.get_file_bytes(file_name))
+    compressed_sizes = measure_ad_gc_forms(file_name, headers, max_workers)
+
+    return [DataEntry.from_dict({
+            "Input": file_name,
+            "Output": join(output_folder, f"AdGCForm {header.location:08x}.dat"),
+            "lookbackBitSize": header.lookback_bit_size,
+            "repetitionBitSize": header.repetition_bit_size,
+            "size": header.original_size,
+            "offset": header.location,
+            "compressedSize": compressed_size,
+            "compressionFlag": header.compression_flag,
+    }) for header, compressed_size in zip(headers, compressed_sizes)]
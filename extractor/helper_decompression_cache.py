@@ -0,0 +1,169 @@
+from __future__ import annotations
+from os.path import join, exists, abspath, dirname
+from hashlib import blake2b
+import os, json
+from helper_mssb_data import ArchiveDecompressor, file_cache
+from helper_file_system import DECOMPRESSION_CACHE_FOLDER, DECOMPRESSION_CACHE_LIMIT
+
+class DecompressionCache:
+    NAME_FILE_ARCHIVES = 'archives.json'
+    HASH_CHUNK_SIZE = 0x100_0000
+
+    def __init__(self, folder:str, max_size:int) -> None:
+        self.folder = folder
+        self.max_size = max_size
+        self.__total_size = None
+        self.__archive_hashes = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def archive_hash(self, file_name:str) -> str:
+        # hashing a whole game image is slow, so the hash is remembered against the file's size and modified time
+        stat = os.stat(file_name)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        file_name = abspath(file_name)
+
+        if file_name not in self.__archive_hashes:
+            self.__archive_hashes.update(self.__load_archive_hashes())
+
+        known = self.__archive_hashes.get(file_name, None)
+        if known is not None and known[:2] == stamp:
+            return known[2]
+
+        h = blake2b(digest_size=20)
+        with open(file_name, 'rb') as f:
+            while chunk := f.read(self.HASH_CHUNK_SIZE):
+                h.update(chunk)
+
+        self.__archive_hashes[file_name] = stamp + [h.hexdigest()]
+        self.__save_archive_hashes()
+        return h.hexdigest()
+
+    def __load_archive_hashes(self) -> dict:
+        try:
+            with open(join(self.folder, self.NAME_FILE_ARCHIVES), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __save_archive_hashes(self):
+        all_hashes = self.__load_archive_hashes()
+        all_hashes.update(self.__archive_hashes)
+        self.__write_atomic(join(self.folder, self.NAME_FILE_ARCHIVES), json.dumps(all_hashes, indent=2).encode())
+
+    def key(self, file_name:str, lookback_bit_size:int, repetition_bit_size:int, original_size:int, start:int, end:int=None, kind:str='data') -> str:
+        # with no original size the end bound decides where decompression stops, so it becomes part of the key
+        fields = (kind, self.archive_hash(file_name), start, lookback_bit_size, repetition_bit_size, original_size, end if original_size is None else None)
+        return blake2b(repr(fields).encode(), digest_size=20).hexdigest()
+
+    def __path(self, key:str) -> str:
+        return join(self.folder, key[:2], f"{key}.bin")
+
+    def __contains__(self, key:str) -> bool:
+        return self.enabled and exists(self.__path(key))
+
+    def get(self, key:str) -> bytes:
+        if not self.enabled:
+            return None
+
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        except OSError:
+            return None
+
+        # touch the file, the modified time is what eviction orders by
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def put(self, key:str, payload:bytes):
+        if not self.enabled or len(payload) > self.max_size:
+            return
+
+        path = self.__path(key)
+        if exists(path):
+            return
+        self.__write_atomic(path, payload)
+
+        if self.__total_size is None:
+            self.__total_size = sum(size for _, _, size in self.__cached_files())
+        else:
+            self.__total_size += len(payload)
+
+        if self.__total_size > self.max_size:
+            self.__evict()
+
+    def __cached_files(self) -> list[tuple[int, str, int]]:
+        files = []
+        for sub_folder in os.scandir(self.folder) if exists(self.folder) else []:
+            if not sub_folder.is_dir():
+                continue
+            for entry in os.scandir(sub_folder.path):
+                if entry.name.endswith('.bin'):
+                    # another worker may evict or replace the file while it's listed
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        return files
+
+    def __evict(self):
+        # least recently used first, down to 90% of the limit so every put doesn't trigger a scan
+        files = sorted(self.__cached_files())
+        total_size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if total_size <= self.max_size * 9 // 10:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+        self.__total_size = total_size
+
+    def __write_atomic(self, path:str, payload:bytes):
+        # other worker processes may be reading or writing the same key, or making the same folder
+        os.makedirs(dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, path)
+
+decompression_cache = DecompressionCache(DECOMPRESSION_CACHE_FOLDER, DECOMPRESSION_CACHE_LIMIT)
+
+def cached_decompress(file_name:str, lookback_bit_size:int, repetition_bit_size:int, original_size:int, start:int, end:int=None) -> bytearray:
+    if not decompression_cache.enabled:
+        return ArchiveDecompressor(file_cache.get_file_bytes(file_name), lookback_bit_size, repetition_bit_size, original_size, start, end).decompress()
+
+    key = decompression_cache.key(file_name, lookback_bit_size, repetition_bit_size, original_size, start, end)
+    payload = decompression_cache.get(key)
+    if payload is not None:
+        return bytearray(payload)
+
+    decompressed_bytes = ArchiveDecompressor(file_cache.get_file_bytes(file_name), lookback_bit_size, repetition_bit_size, original_size, start, end).decompress()
+    decompression_cache.put(key, decompressed_bytes)
+    return decompressed_bytes
+
+def cached_is_valid_decompression(file_name:str, lookback_bit_size:int, repetition_bit_size:int, original_size:int, start:int, end:int=None) -> bool:
+    if not decompression_cache.enabled:
+        return ArchiveDecompressor(file_cache.get_file_bytes(file_name), lookback_bit_size, repetition_bit_size, original_size, start, end).is_valid_decompression()
+
+    # a stored payload means the stream decompressed, so it is valid
+    if decompression_cache.key(file_name, lookback_bit_size, repetition_bit_size, original_size, start, end) in decompression_cache:
+        return True
+
+    key = decompression_cache.key(file_name, lookback_bit_size, repetition_bit_size, original_size, start, end, 'valid')
+    payload = decompression_cache.get(key)
+    if payload is not None:
+        return payload == b'\x01'
+
+    valid = ArchiveDecompressor(file_cache.get_file_bytes(file_name), lookback_bit_size, repetition_bit_size, original_size, start, end).is_valid_decompression()
+    decompression_cache.put(key, b'\x01' if valid else b'\x00')
+    return valid
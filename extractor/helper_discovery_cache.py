@@ -0,0 +1,77 @@
+from __future__ import annotations
+from os.path import join, exists
+from hashlib import blake2b
+import os, json
+from helper_mssb_data import ensure_dir
+from helper_decompression_cache import decompression_cache
+
+# results.json records the hash of every archive it was discovered from under this key
+STAMP_KEY = 'Archives'
+
+def archive_stamp(files:list[str]) -> dict[str, str]:
+    return {x: decompression_cache.archive_hash(x) for x in files}
+
+def is_archive_stamp_current(stamp:dict[str, str]) -> bool:
+    # results written before stamping can't be checked, they're trusted like before
+    if stamp is None:
+        return True
+
+    return all(exists(x) and decompression_cache.archive_hash(x) == h for x, h in stamp.items())
+
+def is_stamp_current(results:dict) -> bool:
+    return is_archive_stamp_current(results.get(STAMP_KEY, None))
+
+# bump a stage's version whenever what it computes changes, so results cached by the old code aren't reused.
+# Later stages take the key of the stages they use, so they rerun along with it
+STAGE_VERSIONS = {
+    'rels':               1,
+    'fingerprints':       1,
+    'brute force':        1,
+    'AdGCForms':          1,
+    'raw':                1,
+    'unreferenced sizes': 1,
+}
+
+class DiscoveryCache:
+    # every discovery stage is stored with a key made from everything it was computed from,
+    # the hashes of the archives it read and the keys of the stages it used the results of.
+    # A stage only reruns when its key changes
+    def __init__(self, folder:str) -> None:
+        self.folder = folder
+
+    @staticmethod
+    def key(stage:str, *inputs) -> str:
+        return blake2b(json.dumps([stage, STAGE_VERSIONS[stage], *inputs], sort_keys=True).encode(), digest_size=20).hexdigest()
+
+    def __path(self, stage:str) -> str:
+        return join(self.folder, f"{stage}.json")
+
+    def get(self, stage:str, key:str):
+        try:
+            with open(self.__path(stage), 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if cached.get('Key', None) != key:
+            return None
+        return cached['Result']
+
+    def put(self, stage:str, key:str, result):
+        ensure_dir(self.folder)
+        path = self.__path(stage)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'Key': key, 'Result': result}, f)
+        os.replace(temp_path, path)
+
+    def run(self, stage:str, key:str, compute):
+        # compute must return something json can store
+        result = self.get(stage, key)
+        if result is not None:
+            print(f'{stage}: inputs unchanged, using cached results')
+            return result
+
+        result = compute()
+        self.put(stage, key, result)
+        return result
@@ -11,6 +11,12 @@ NAME_FILE_ZZZZ        = 'ZZZZ.dat'
 NAME_FILE_MAIN        = 'main.dol'
 NAME_FILE_RESULTS     = 'results.json'
 NAME_FILE_FILENAMES   = 'FileNames.json'
+NAME_FOLDER_MODIFIED  = 'Modified files'
+NAME_FOLDER_REPACK    = 'Repacked'
+NAME_FOLDER_DISCOVERY_CACHE = 'discovery cache'
+
+DECOMPRESSION_CACHE_FOLDER = join(OUTPUT_FOLDER, 'decompression cache')
+DECOMPRESSION_CACHE_LIMIT  = 2_000_000_000 # 2 gb, 0 disables the cache
 
 US_FOLDER             = 'US'
 US_DATA_FOLDER        = join(DATA_FOLDER,        US_FOLDER)
@@ -19,6 +25,8 @@ US_AAAA_FILE          = join(US_DATA_FOLDER,     NAME_FILE_AAAA)
 US_ZZZZ_FILE          = join(US_DATA_FOLDER,     NAME_FILE_ZZZZ)
 US_MAIN_FILE          = join(US_DATA_FOLDER,     NAME_FILE_MAIN)
 US_RESULTS_FILE       = join(US_OUTPUT_FOLDER,   NAME_FILE_RESULTS) 
+US_MODIFIED_FOLDER    = join(US_OUTPUT_FOLDER,   NAME_FOLDER_MODIFIED)
+US_REPACK_FOLDER      = join(US_OUTPUT_FOLDER,   NAME_FOLDER_REPACK)
 US_CUSTOM_FILENAMES   = join(US_DATA_FOLDER,     NAME_FILE_FILENAMES) 
 
 JP_FOLDER             = 'JP'
@@ -28,6 +36,8 @@ JP_AAAA_FILE          = join(JP_DATA_FOLDER,     NAME_FILE_AAAA)
 JP_ZZZZ_FILE          = join(JP_DATA_FOLDER,     NAME_FILE_ZZZZ)
 JP_MAIN_FILE          = join(JP_DATA_FOLDER,     NAME_FILE_MAIN)
 JP_RESULTS_FILE       = join(JP_OUTPUT_FOLDER,   NAME_FILE_RESULTS) 
+JP_MODIFIED_FOLDER    = join(JP_OUTPUT_FOLDER,   NAME_FOLDER_MODIFIED)
+JP_REPACK_FOLDER      = join(JP_OUTPUT_FOLDER,   NAME_FOLDER_REPACK)
 JP_CUSTOM_FILENAMES   = join(JP_DATA_FOLDER,     NAME_FILE_FILENAMES) 
 
 EU_FOLDER           = 'EU'
@@ -37,6 +47,8 @@ EU_AAAA_FILE          = join(EU_DATA_FOLDER,     NAME_FILE_AAAA)
 EU_ZZZZ_FILE          = join(EU_DATA_FOLDER,     NAME_FILE_ZZZZ)
 EU_MAIN_FILE          = join(EU_DATA_FOLDER,     NAME_FILE_MAIN)
 EU_RESULTS_FILE       = join(EU_OUTPUT_FOLDER,   NAME_FILE_RESULTS) 
+EU_MODIFIED_FOLDER    = join(EU_OUTPUT_FOLDER,   NAME_FOLDER_MODIFIED)
+EU_REPACK_FOLDER      = join(EU_OUTPUT_FOLDER,   NAME_FOLDER_REPACK)
 EU_CUSTOM_FILENAMES   = join(EU_DATA_FOLDER,     NAME_FILE_FILENAMES) 
 
 BETA_FOLDER           = 'Beta'
@@ -46,6 +58,8 @@ BETA_AAAA_FILE        = join(BETA_DATA_FOLDER,   NAME_FILE_AAAA)
 BETA_ZZZZ_FILE        = join(BETA_DATA_FOLDER,   NAME_FILE_ZZZZ)
 BETA_MAIN_FILE        = join(BETA_DATA_FOLDER,   NAME_FILE_MAIN)
 BETA_RESULTS_FILE     = join(BETA_OUTPUT_FOLDER, NAME_FILE_RESULTS) 
+BETA_MODIFIED_FOLDER  = join(BETA_OUTPUT_FOLDER, NAME_FOLDER_MODIFIED)
+BETA_REPACK_FOLDER    = join(BETA_OUTPUT_FOLDER, NAME_FOLDER_REPACK)
 BETA_CUSTOM_FILENAMES = join(BETA_DATA_FOLDER,   NAME_FILE_FILENAMES) 
 
 FAMILY_FOLDER           = 'Family'
@@ -55,4 +69,6 @@ FAMILY_AAAA_FILE        = join(FAMILY_DATA_FOLDER,   NAME_FILE_AAAA)
 FAMILY_ZZZZ_FILE        = join(FAMILY_DATA_FOLDER,   NAME_FILE_ZZZZ)
 FAMILY_MAIN_FILE        = join(FAMILY_DATA_FOLDER,   NAME_FILE_MAIN)
 FAMILY_RESULTS_FILE     = join(FAMILY_OUTPUT_FOLDER, NAME_FILE_RESULTS) 
+FAMILY_MODIFIED_FOLDER  = join(FAMILY_OUTPUT_FOLDER, NAME_FOLDER_MODIFIED)
+FAMILY_REPACK_FOLDER    = join(FAMILY_OUTPUT_FOLDER, NAME_FOLDER_REPACK)
 FAMILY_CUSTOM_FILENAMES = join(FAMILY_DATA_FOLDER,   NAME_FILE_FILENAMES) 
\ No newline at end of file
@@ -1,8 +1,13 @@
 from __future__ import annotations
-from typing import NamedTuple, Union
-from struct import pack, unpack, calcsize
-from os.path import dirname, exists
+from typing import NamedTuple, Union, Iterator, Iterable
+from struct import pack, unpack, calcsize, unpack_from, error as struct_error
+from os.path import dirname, exists, getsize
+from mmap import mmap, ACCESS_READ
 from os import makedirs
+from array import array
+from bisect import bisect_left, bisect_right
+import numpy as np
+import re
 
 class CompressionData(NamedTuple):
     ORIGINAL_DATA = 1
@@ -29,9 +34,330 @@ class CompressionData(NamedTuple):
     def __repr__(self) -> str:
         return self.__str__()
 
+class CompressionInstructions:
+    # every token of a stream as parallel arrays instead of one CompressionData per token.
+    # Literals have a length of 1 and a look_back of 0, repetitions have a data byte of 0
+    def __init__(self, flags:np.ndarray, data:np.ndarray, look_backs:np.ndarray, lengths:np.ndarray) -> None:
+        self.flags = flags
+        self.data = data
+        self.look_backs = look_backs
+        self.lengths = lengths
+        # where each token starts writing in the decompressed output
+        self.output_offsets = np.zeros(len(lengths), np.int64)
+        np.cumsum(lengths[:-1], out=self.output_offsets[1:])
+
+    @staticmethod
+    def from_tokens(flags:array, values:array, lengths:array) -> CompressionInstructions:
+        flags = np.frombuffer(flags, np.uint8)
+        values = np.frombuffer(values, np.uint32)
+        is_original_data = flags == CompressionData.ORIGINAL_DATA
+        return CompressionInstructions(flags, np.where(is_original_data, values, 0).astype(np.uint8), np.where(is_original_data, 0, values).astype(np.uint32), np.frombuffer(lengths, np.uint32))
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return CompressionInstructions(self.flags[key], self.data[key], self.look_backs[key], self.lengths[key])
+        if self.flags[key] == CompressionData.ORIGINAL_DATA:
+            return CompressionData(flag=CompressionData.ORIGINAL_DATA, data=int(self.data[key]))
+        return CompressionData(flag=CompressionData.REPETITION_DATA, look_back=int(self.look_backs[key]), length=int(self.lengths[key]))
+
+    def __iter__(self) -> Iterator[CompressionData]:
+        for i in range(len(self)):
+            yield self[i]
+
+def byte_view(buffer, start:int=0, end:int=None) -> memoryview:
+    # read-only view over any buffer-protocol object (bytes, bytearray, mmap, memoryview) without copying it
+    view = memoryview(buffer)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view[start:end].toreadonly()
+
+class InvalidLookbackError(ValueError):
+    pass
+
+class LZStreamDecoder:
+    # how many 32 bit words are unpacked from the source per refill
+    CHUNK_WORDS = 0x400
+    BIT_MASKS = [(1 << x) - 1 for x in range(33)]
+
+    def __init__(self, source:bytes, lookback_bit_count:int, repetition_bit_count:int) -> None:
+        self.source = source
+        self.source_length = len(source)
+        self.lookback_bit_count = lookback_bit_count
+        self.repetition_bit_count = repetition_bit_count
+        # the widths are fixed for a stream, so the masks only need to be built once
+        self.lookback_mask = self.BIT_MASKS[lookback_bit_count]
+        self.repetition_mask = self.BIT_MASKS[repetition_bit_count]
+        # longest run a single repetition token can write
+        self.max_run_length = self.repetition_mask + 2
+        self.reset()
+
+    def reset(self):
+        self.bit_buffer = 0
+        self.bits_in_buffer = 0
+        self.output_position = 0
+        self.__words = ()
+        self.__word_cursor = 0
+        self.__chunk_start = 0
+
+    @property
+    def byte_index(self) -> int:
+        return self.__chunk_start + 4 * self.__word_cursor
+
+    def get_state(self) -> tuple[int, int, int]:
+        return self.byte_index, self.bit_buffer, self.bits_in_buffer
+
+    def set_state(self, byte_index:int, bit_buffer:int, bits_in_buffer:int, output_position:int):
+        # resume from a token boundary, out must already hold the lookback window before output_position
+        self.reset()
+        self.__chunk_start = byte_index
+        self.bit_buffer = bit_buffer
+        self.bits_in_buffer = bits_in_buffer
+        self.output_position = output_position
+
+    def __next_word(self) -> int:
+        if self.__word_cursor == len(self.__words):
+            # words are unpacked a chunk at a time, the state stays consistent if the source runs out here
+            self.__chunk_start += 4 * self.__word_cursor
+            self.__word_cursor = 0
+            self.__words = ()
+            count = min(self.CHUNK_WORDS, (self.source_length - self.__chunk_start) // 4)
+            if count <= 0:
+                raise ValueError("No more ints to read")
+            self.__words = unpack_from(f'>{count}I', self.source, self.__chunk_start)
+
+        word = self.__words[self.__word_cursor]
+        self.__word_cursor += 1
+        return word
+
+    def __read_bits(self, buf:int, nbits:int, count:int) -> tuple[int, int, int]:
+        # (value, bit buffer, bits in buffer) after reading count bits.
+        # When the buffer runs short, the bits left in it become the high bits of the value
+        if nbits >= count:
+            return buf & self.BIT_MASKS[count], buf >> count, nbits - count
+
+        word = self.__next_word()
+        needed = count - nbits
+        return (buf << needed) | (word & self.BIT_MASKS[needed]), word >> needed, 32 - needed
+
+    def tokens(self, target:int=None, stop_at_end:bool=None, stop_at_padding=None) -> Iterator[tuple[int, int]]:
+        # every token from the current state on, as (value, length). Literals have a length of 1 and their byte as
+        # the value, repetitions have their lookback as the value. Stops once target bytes are covered (the last run
+        # may overshoot it), or when the source runs out of bits if no target is given. stop_at_end applies that
+        # end check with a target too. stop_at_padding(byte index, output position) is asked at every token boundary
+        # where the rest of the current word is zero, like the padding after a stream's last token, and stops there if true
+        lookback_mask   = self.lookback_mask
+        repetition_mask = self.repetition_mask
+        lookback_bits   = self.lookback_bit_count
+        repetition_bits = self.repetition_bit_count
+        repetition_shift = 1 + lookback_bits
+        token_bits      = 1 + lookback_bits + repetition_bits
+        # enough bits for either kind of token
+        fast_bits       = max(token_bits, 9)
+        read_bits       = self.__read_bits
+        last_byte       = self.source_length - 1
+        limit           = 1 << 62 if target is None else target
+        stop_at_end     = target is None if stop_at_end is None else stop_at_end
+
+        buf      = self.bit_buffer
+        nbits    = self.bits_in_buffer
+        position = self.output_position
+
+        try:
+            while position < limit:
+                if buf == 0:
+                    if stop_at_end and self.byte_index >= last_byte:
+                        return
+                    if stop_at_padding is not None and stop_at_padding(self.byte_index, position):
+                        return
+
+                if nbits >= fast_bits:
+                    # the whole token is in the current word
+                    if buf & 1:
+                        literal = (buf >> 1) & 0xff
+                        buf >>= 9
+                        nbits -= 9
+                        position += 1
+                        yield literal, 1
+                        continue
+                    far_back = (buf >> 1) & lookback_mask
+                    length = ((buf >> repetition_shift) & repetition_mask) + 2
+                    buf >>= token_bits
+                    nbits -= token_bits
+                else:
+                    # the token straddles a word boundary, read it field by field
+                    flag, buf, nbits = read_bits(buf, nbits, 1)
+                    if flag:
+                        literal, buf, nbits = read_bits(buf, nbits, 8)
+                        position += 1
+                        yield literal, 1
+                        continue
+                    far_back, buf, nbits = read_bits(buf, nbits, lookback_bits)
+                    length, buf, nbits = read_bits(buf, nbits, repetition_bits)
+                    length += 2
+
+                if far_back >= position:
+                    # if there is a sequence requested to be read that is before the start of the array, then stop
+                    raise InvalidLookbackError("Invalid data, received too far lookback")
+                position += length
+                yield far_back, length
+        finally:
+            self.bit_buffer      = buf
+            self.bits_in_buffer  = nbits
+            self.output_position = position
+
+    def decode_into(self, out:bytearray, target:int=None, stop_at_end:bool=None) -> int:
+        # the same walk as tokens(), inlined since every decompression runs through it.
+        # out is grown as needed, the caller is responsible for trimming it to the returned position
+        lookback_mask   = self.lookback_mask
+        repetition_mask = self.repetition_mask
+        lookback_bits   = self.lookback_bit_count
+        repetition_bits = self.repetition_bit_count
+        repetition_shift = 1 + lookback_bits
+        token_bits      = 1 + lookback_bits + repetition_bits
+        # enough bits for either kind of token
+        fast_bits       = max(token_bits, 9)
+        max_run         = self.max_run_length
+        masks           = self.BIT_MASKS
+        last_byte       = self.source_length - 1
+        until_empty     = target is None
+        stop_at_end     = until_empty if stop_at_end is None else stop_at_end
+
+        buf      = self.bit_buffer
+        nbits    = self.bits_in_buffer
+        position = self.output_position
+        words    = self.__words
+        cursor   = self.__word_cursor
+        word_count = len(words)
+
+        if not until_empty and len(out) < target + max_run:
+            out.extend(bytes(target + max_run - len(out)))
+
+        try:
+            while True:
+                # out always has room for one more full run below limit
+                limit = target if not until_empty else len(out) - max_run
+                while position < limit:
+                    if stop_at_end and buf == 0 and self.__chunk_start + 4 * cursor >= last_byte:
+                        return position
+
+                    if nbits >= fast_bits:
+                        # the whole token is in the current word
+                        if buf & 1:
+                            out[position] = (buf >> 1) & 0xff
+                            position += 1
+                            buf >>= 9
+                            nbits -= 9
+                            continue
+                        far_back = (buf >> 1) & lookback_mask
+                        length = ((buf >> repetition_shift) & repetition_mask) + 2
+                        buf >>= token_bits
+                        nbits -= token_bits
+                    else:
+                        # tokens are shorter than a word, so at most one word boundary falls inside one
+                        word = 0
+                        if nbits < (9 if buf & 1 else token_bits):
+                            if cursor == word_count:
+                                # __next_word unpacks the next chunk, cursor is 0 even if the source runs out there
+                                self.__word_cursor = cursor
+                                cursor = 0
+                                word = self.__next_word()
+                                words = self.__words
+                                word_count = len(words)
+                                cursor = self.__word_cursor
+                            else:
+                                word = words[cursor]
+                                cursor += 1
+
+                        # read it field by field, bits left in the old word become the high bits of the field crossing the boundary
+                        if nbits >= 1:
+                            flag = buf & 1
+                            buf >>= 1
+                            nbits -= 1
+                        else:
+                            flag = word & 1
+                            buf = word >> 1
+                            nbits = 31
+
+                        if flag:
+                            if nbits >= 8:
+                                out[position] = buf & 0xff
+                                buf >>= 8
+                                nbits -= 8
+                            else:
+                                needed = 8 - nbits
+                                out[position] = (buf << needed) | (word & masks[needed])
+                                buf = word >> needed
+                                nbits = 32 - needed
+                            position += 1
+                            continue
+
+                        if nbits >= lookback_bits:
+                            far_back = buf & lookback_mask
+                            buf >>= lookback_bits
+                            nbits -= lookback_bits
+                        else:
+                            needed = lookback_bits - nbits
+                            far_back = (buf << needed) | (word & masks[needed])
+                            buf = word >> needed
+                            nbits = 32 - needed
+
+                        if nbits >= repetition_bits:
+                            length = (buf & repetition_mask) + 2
+                            buf >>= repetition_bits
+                            nbits -= repetition_bits
+                        else:
+                            needed = repetition_bits - nbits
+                            length = ((buf << needed) | (word & masks[needed])) + 2
+                            buf = word >> needed
+                            nbits = 32 - needed
+
+                    if far_back >= position:
+                        # if there is a sequence requested to be read that is before the start of the array, then stop
+                        raise InvalidLookbackError("Invalid data, received too far lookback")
+
+                    start = position - 1 - far_back
+                    end = position + length
+                    if far_back >= length - 1:
+                        # source run ends before the destination starts, copy it in one go
+                        out[position:end] = out[start:start + length]
+                    else:
+                        # overlapping run, repeat the pattern between start and position
+                        distance = far_back + 1
+                        out[position:end] = (out[start:position] * (length // distance + 1))[:length]
+                    position = end
+
+                if not until_empty:
+                    return position
+                out.extend(bytes(len(out) + max_run))
+        finally:
+            self.bit_buffer      = buf
+            self.bits_in_buffer  = nbits
+            self.output_position = position
+            self.__word_cursor   = cursor
+
+    def measure(self, target:int=None, stop_at_padding=None) -> int:
+        # walks the tokens without writing any output, only counting the bytes they would produce
+        for _ in self.tokens(target, None, stop_at_padding):
+            pass
+        return self.output_position
+
+    def read_tokens(self, target:int=None) -> tuple[array, array, array]:
+        # each token's flag, literal byte or lookback, and length
+        flags   = array('B')
+        values  = array('I')
+        lengths = array('I')
+        for value, length in self.tokens(target):
+            flags.append(length == 1)
+            values.append(value)
+            lengths.append(length)
+        return flags, values, lengths
+
 class ArchiveDecompressor:
-    def __init__(self, buffer:bytearray, lookback_bit_count:int, repetition_bit_count:int, original_size:int=None) -> None:
-        self.bytes_to_decompress = bytearray(buffer)
+    def __init__(self, buffer:bytes, lookback_bit_count:int, repetition_bit_count:int, original_size:int=None, start:int=0, end:int=None) -> None:
+        self.bytes_to_decompress = byte_view(buffer, start, end)
         self.lookback_bit_count = lookback_bit_count
         self.repetition_bit_count = repetition_bit_count
         self.original_size = original_size
@@ -41,52 +367,6 @@ class ArchiveDecompressor:
     def compressed_size(self):
         return self.__byte_index
 
-    def __read_int(self)->int:
-        if(self.__byte_index + 3 >= len(self.bytes_to_decompress)):
-            raise ValueError("No more ints to read")
-
-        value = int.from_bytes(self.bytes_to_decompress[self.__byte_index : self.__byte_index + 4], 'big')
-
-        self.__byte_index += 4
-
-        return value
-
-    def __has_bits(self):
-        if self.__byte_index >= len(self.bytes_to_decompress) - 1:
-            return self.__bit_buffer != 0
-        return True
-
-    def __should_keep_decompressing(self, size:int):
-        if self.original_size != None:
-            return size < self.original_size
-        return self.__has_bits()
-
-    def __read_bits(self, bit_count:int):
-        # if enough bits in buffer
-        if bit_count <= self.__bits_in_buffer:
-            # read the bits from the low end
-            value = self.__bit_buffer & (2**bit_count - 1)
-            # rotate out the bits
-            self.__bit_buffer >>= bit_count
-            # remove the count of those bits
-            self.__bits_in_buffer -= bit_count
-        else:
-            # else not enough bits,
-            # we need a new int
-            new_buffer = self.__read_int()
-            
-            new_bits_needed = bit_count - self.__bits_in_buffer
-            # the bits remaining in the buffer will be the high bits for the output data
-            value = self.__bit_buffer << new_bits_needed
-
-            self.__bits_in_buffer = 32 - new_bits_needed
-            # the bits we're using from the new data will become the low bits of the output data
-            value |= (new_buffer & (0xffffffff >> self.__bits_in_buffer))
-            # rotate out the data
-            self.__bit_buffer = new_buffer >> new_bits_needed
-
-        return value
-    
     def __reset_buffer(self):
         self.__byte_index = 0
         self.__bit_buffer = 0
@@ -98,79 +378,176 @@ class ArchiveDecompressor:
         
         self.__reset_buffer()
 
-        written_bit_count = 0
-
-        while self.__should_keep_decompressing(written_bit_count):
-            # returns 0 or 1
-            head_bit = self.__read_bits(1)
-            if head_bit == 0:                
-                far_back = self.__read_bits(self.lookback_bit_count)
-                repetitions = self.__read_bits(self.repetition_bit_count) + 2
-                if far_back >= written_bit_count:
-                    # if there is a sequence requested to be read that is before the start of the array, then stop
-                    return False
-                written_bit_count += repetitions
-            else:
-                self.__read_bits(8)
-                written_bit_count += 1
+        decoder = LZStreamDecoder(self.bytes_to_decompress, self.lookback_bit_count, self.repetition_bit_count)
+        try:
+            decoder.measure(self.original_size)
+        except InvalidLookbackError:
+            # if there is a sequence requested to be read that is before the start of the array, then stop
+            return False
+        finally:
+            self.__byte_index = decoder.byte_index
         return True
+
+    def measure(self) -> tuple[int, int]:
+        # compressed and decompressed size of the stream, found without building the output
+        if self.lookback_bit_count == 0 and self.repetition_bit_count == 0:
+            size = len(self.bytes_to_decompress[:self.original_size])
+            return size, size
+
+        self.__reset_buffer()
+
+        decoder = LZStreamDecoder(self.bytes_to_decompress, self.lookback_bit_count, self.repetition_bit_count)
+        try:
+            decompressed_size = decoder.measure(self.original_size)
+        finally:
+            self.__byte_index = decoder.byte_index
+        return self.compressed_size, decompressed_size
     
-    def get_compression_instructions(self) -> list[CompressionData]:
+    def get_compression_instructions(self) -> CompressionInstructions:
         if self.lookback_bit_count == 0 and self.repetition_bit_count == 0:
-            return []
+            return CompressionInstructions.from_tokens(array('B'), array('I'), array('I'))
         
         self.__reset_buffer()
 
-        written_bit_count = 0
-        instructions = []
-        while self.__should_keep_decompressing(written_bit_count):
-            # returns 0 or 1
-            head_bit = self.__read_bits(1)
-            if head_bit == 0:                
-                far_back = self.__read_bits(self.lookback_bit_count)
-                length = self.__read_bits(self.repetition_bit_count) + 2
-                if far_back > written_bit_count:
-                    # if there is a sequence requested to be read that is before the start of the array, then stop
-                    raise ValueError("Invalid data, received too far lookback")
-
-                instructions.append(CompressionData(flag=head_bit, look_back=far_back, length=length))
-            else:
-                instructions.append(CompressionData(flag=head_bit, data=self.__read_bits(8)))
-                length = 1
-
-            written_bit_count += length
-        return instructions
+        decoder = LZStreamDecoder(self.bytes_to_decompress, self.lookback_bit_count, self.repetition_bit_count)
+        try:
+            return CompressionInstructions.from_tokens(*decoder.read_tokens(self.original_size))
+        finally:
+            self.__byte_index = decoder.byte_index
 
     def decompress(self):
         if self.lookback_bit_count == 0 and self.repetition_bit_count == 0:
             if self.original_size != None:
-                return self.bytes_to_decompress[:self.original_size]
+                return bytearray(self.bytes_to_decompress[:self.original_size])
             else:
                 return bytearray()
         
         self.__reset_buffer()
 
+        decoder = LZStreamDecoder(self.bytes_to_decompress, self.lookback_bit_count, self.repetition_bit_count)
         final_data = bytearray()
+        try:
+            decoder.decode_into(final_data, self.original_size)
+        finally:
+            self.__byte_index = decoder.byte_index
 
-        while self.__should_keep_decompressing(len(final_data)):
-            # returns 0 or 1
-            head_bit = self.__read_bits(1)
-            if head_bit == CompressionData.REPETITION_DATA:
-
-                far_back = self.__read_bits(self.lookback_bit_count)
-                
-                repetitions = self.__read_bits(self.repetition_bit_count) + 2
+        del final_data[decoder.output_position:]
+        return final_data
 
-                if far_back > len(final_data):
-                    # if there is a sequence requested to be read that is before the start of the array, then stop
-                    raise ValueError("Invalid data, received too far lookback")
-                while repetitions != 0:
-                    final_data.append(final_data[-1 - far_back])
-                    repetitions -= 1
-            else:
-                final_data.append(self.__read_bits(8))
+# output decoded from the start of the next sector when checking whether a new stream starts there
+STREAM_START_CHECK_SIZE = 0x200
+
+def starts_stream(buffer:bytes, lookback_bit_count:int, repetition_bit_count:int, start:int, end:int=None) -> bool:
+    # whether the data at start decodes as the beginning of a stream, every lookback has to stay inside what's been written.
+    # Data from the middle of a stream almost always looks back past the start within a few tokens
+    decoder = LZStreamDecoder(byte_view(buffer, start, end), lookback_bit_count, repetition_bit_count)
+    try:
+        decoder.measure(STREAM_START_CHECK_SIZE)
+    except InvalidLookbackError:
+        return False
+    except ValueError:
+        # ran out of data before anything invalid
+        pass
+    return True
+
+def find_stream_end(buffer:bytes, lookback_bit_count:int, repetition_bit_count:int, start:int, end:int=None) -> tuple[int, int]:
+    # (compressed size, original size) of a stream with no recorded sizes. Streams are flushed with zero bits, so the end
+    # is a token boundary where the rest of the word is zero and the next word is either zero padding or, on a sector
+    # boundary, the start of the next stream. The stream also ends at end (the next known entry) or, if a token
+    # doesn't decode, at the last boundary like that before it.
+    # Zero bits decode as repetitions of the last two bytes, so a stream with zero bits from a token boundary to the end
+    # of a word and then a whole zero word is cut there, it can't be told apart from its padding
+    data = byte_view(buffer)
+    end = len(data) if end == None else min(end, len(data))
+    ends = []
+
+    def stop_at_padding(byte_index:int, position:int) -> bool:
+        if position == 0:
+            return False
+        ends.append((byte_index, position))
+        offset = start + byte_index
+        if offset + 4 > end or bytes(data[offset:offset + 4]) == bytes(4):
+            return True
+        return offset % 0x800 == 0 and starts_stream(data, lookback_bit_count, repetition_bit_count, offset, end)
+
+    decoder = LZStreamDecoder(data[start:end], lookback_bit_count, repetition_bit_count)
+    try:
+        original_size = decoder.measure(None, stop_at_padding)
+    except ValueError:
+        if len(ends) == 0:
+            # nothing from the failing token on can belong to the stream
+            return decoder.byte_index, decoder.output_position
+        return ends[-1]
+    return decoder.byte_index, original_size
+
+class StreamingDecompressor:
+    DEFAULT_CHUNK_SIZE = 0x10000
+
+    # yields the output in chunks while only holding the lookback window and the chunk being decoded,
+    # for dumping or hashing streams too large to keep in memory
+    def __init__(self, buffer:bytes, lookback_bit_count:int, repetition_bit_count:int, original_size:int=None, start:int=0, end:int=None, chunk_size:int=DEFAULT_CHUNK_SIZE) -> None:
+        self.bytes_to_decompress = byte_view(buffer, start, end)
+        self.lookback_bit_count = lookback_bit_count
+        self.repetition_bit_count = repetition_bit_count
+        self.original_size = original_size
+        self.chunk_size = chunk_size
+        self.compressed_size = 0
 
-        return final_data
+    def __iter__(self) -> Iterator[bytes]:
+        if self.lookback_bit_count == 0 and self.repetition_bit_count == 0:
+            # same as ArchiveDecompressor, raw data needs a size
+            raw = self.bytes_to_decompress[:self.original_size] if self.original_size != None else b''
+            for i in range(0, len(raw), self.chunk_size):
+                yield bytes(raw[i:i + self.chunk_size])
+            self.compressed_size = len(raw)
+            return
+
+        decoder = LZStreamDecoder(self.bytes_to_decompress, self.lookback_bit_count, self.repetition_bit_count)
+        window_size = 1 << self.lookback_bit_count
+        # out holds stream bytes from base onwards, everything before emitted has been yielded
+        out = bytearray()
+        base = 0
+        emitted = 0
+
+        while self.original_size == None or emitted < self.original_size:
+            target = decoder.output_position + self.chunk_size
+            if self.original_size != None:
+                target = min(target, self.original_size - base)
+
+            try:
+                position = decoder.decode_into(out, target, self.original_size == None)
+            finally:
+                self.compressed_size = decoder.byte_index
+
+            # the last run is kept whole even past original_size, like ArchiveDecompressor.decompress and the files extraction writes
+            if position > emitted - base:
+                yield bytes(out[emitted - base : position])
+            emitted = base + position
+
+            if position < target:
+                # ran out of bits before the target, the stream is over
+                break
+
+            # only the last window_size bytes can be looked back on
+            drop = position - window_size
+            if drop > 0:
+                del out[:drop]
+                base += drop
+                decoder.output_position -= drop
+
+    def write_to(self, f) -> int:
+        # writes the whole stream to an open binary file, returns the bytes written
+        size = 0
+        for chunk in self:
+            f.write(chunk)
+            size += len(chunk)
+        return size
+
+    def update_hash(self, h):
+        # feeds the whole stream into a hashlib object
+        for chunk in self:
+            h.update(chunk)
+        return h
 
 class ArchiveCompressor:
     class CompressedBufferHelper:
@@ -241,180 +618,102 @@ class ArchiveCompressor:
         offset:int
         length:int
 
-    def __init__(self, data:bytearray, lookback_bit_size:int, repetition_bit_size:int) -> None:
+    class HashChainMatchFinder:
+        # positions are chained by their first two bytes, so only earlier positions that
+        # share those bytes are ever compared against
+        def __init__(self, data:bytes, window_size:int, max_length:int, min_length:int, max_chain_depth:int) -> None:
+            self.data = bytes(data)
+            self.window_size = window_size
+            self.max_length = max_length
+            self.min_length = min_length
+            self.max_chain_depth = max_chain_depth
+
+            self.head = [-1] * 0x10000
+            self.previous = [-1] * len(self.data)
+            self.inserted = 0
+
+        def __insert_until(self, position:int):
+            data = self.data
+            head = self.head
+            previous = self.previous
+            for i in range(self.inserted, min(position, len(data) - 1)):
+                key = (data[i] << 8) | data[i + 1]
+                previous[i] = head[key]
+                head[key] = i
+            self.inserted = max(self.inserted, position)
+
+        def find(self, position:int) -> ArchiveCompressor.SublistDefinition:
+            # longest match starting at position, positions must be asked for in increasing order
+            data = self.data
+            max_length = min(self.max_length, len(data) - position)
+            if max_length < self.min_length:
+                return None
+
+            self.__insert_until(position)
+
+            target = data[position:position + max_length]
+            lowest_offset = position - self.window_size
+            best_length = self.min_length - 1
+            best_offset = -1
+
+            candidate = self.head[(data[position] << 8) | data[position + 1]]
+            depth = self.max_chain_depth
+            while candidate >= lowest_offset and candidate >= 0 and depth > 0:
+                depth -= 1
+                # only worth measuring if it can beat the best so far
+                if data[candidate + best_length] == target[best_length] and data[candidate:candidate + best_length + 1] == target[:best_length + 1]:
+                    if data[candidate:candidate + max_length] == target:
+                        length = max_length
+                    else:
+                        # binary search for the matching prefix length, matches may run into the lookahead
+                        low, high = best_length + 1, max_length - 1
+                        while low < high:
+                            middle = (low + high + 1) // 2
+                            if data[candidate:candidate + middle] == target[:middle]:
+                                low = middle
+                            else:
+                                high = middle - 1
+                        length = low
+
+                    best_length = length
+                    best_offset = candidate
+                    if length == max_length:
+                        break
+
+                candidate = self.previous[candidate]
+
+            if best_offset < 0:
+                return None
+            return ArchiveCompressor.SublistDefinition(best_offset, best_length)
+
+    def __init__(self, data:bytearray, lookback_bit_size:int, repetition_bit_size:int, max_chain_depth:int=64, lazy_matching:bool=True) -> None:
         self.data = bytearray(data)
         self.lookback_bit_size = lookback_bit_size
         self.repetition_bit_size = repetition_bit_size
-
-        self.cached_data = {}
-
-    # function to help get the count of the matching characters
-    def __length_of_match(data:bytearray, sublist:bytearray):
-        count = 0
-        while count < len(sublist) and (sublist[count] == data[count]):
-            count += 1
-        return count
-
-    def __largest_sublist_cachedsearch(self, sub_start: int, sub_stop: int, sliding_window_start_index: int, sliding_window_stop_index: int, look_ahead_size: int, min_sublist_size:int):
-        sliding_window_size = sliding_window_stop_index - sliding_window_start_index
-
-        sublist = self.data[sub_start:sub_stop]
-        
-        first_char = sublist[0]
-
-        cached_ind_set:list = self.cached_data.get(first_char, None)
-        if cached_ind_set != None:
-            to_remove = []
-            match_length = -1
-            match_index = -1
-
-            for cached_ind in cached_ind_set:
-                if cached_ind < (sub_start - sliding_window_size):
-                    to_remove.append(cached_ind)
-                    continue
-
-                len_of_match = ArchiveCompressor.__length_of_match(self.data[cached_ind:cached_ind+sub_stop-sub_start], sublist)
-
-                if len_of_match > match_length:
-                    match_length = len_of_match
-                    match_index = cached_ind
-                
-            cached_ind_set.append(sub_start)
-            for rem in to_remove:
-                cached_ind_set.remove(rem)
-
-            for sublist_index in range(1, match_length):
-                char = sublist[sublist_index]
-                char_ind = sub_start + sublist_index
-                
-                cached_ind_set = self.cached_data.get(char, None)
-                if cached_ind_set == None:
-                    cached_ind_set = set()
-                    self.cached_data[char] = cached_ind_set
-
-                cached_ind_set.append(char_ind)
-            
-            if match_length >= min_sublist_size:
-                return self.SublistDefinition(match_index, match_length)
-        else:
-            self.cached_data[first_char] = [sub_start]
-
-        return None
-    
-    def __largest_sublist_bytesearch(self, sub_start: int, sub_stop: int, sliding_window_start_index: int, sliding_window_stop_index: int, look_ahead_size: int, min_sublist_size:int) -> SublistDefinition:
-
-        sub_start                   = max(0, sub_start)
-        sliding_window_start_index  = max(0, sliding_window_start_index)
-
-        dat_len                     = len(self.data)
-
-        sub_stop                    = min(dat_len, sub_stop)
-        sliding_window_stop_index   = min(dat_len, sliding_window_stop_index)
-
-        sublist = self.data[sub_start:sub_stop]
-
-        
-        # -------- bytearray built-in find ----------- 2.5 seconds
-
-        # size of sliding window | first offset that is unacceptable
-        unusable_lookahead_ind = sliding_window_stop_index - sliding_window_start_index
-        # cut sliding window and lookahead to search in
-        sliding_window_and_lookahead = self.data[sliding_window_start_index : sliding_window_stop_index + look_ahead_size]
-        # only look for sublists for sizes above min_sublist_size
-        while len(sublist) >= min_sublist_size:
-            # finds first instance, returns >= 0 if found, else -1
-            ind = sliding_window_and_lookahead.find(sublist)
-            # checks to see if any found and first instance is not in the lookahead
-            if 0 <= ind < unusable_lookahead_ind:
-                # return offset into large array
-                return self.SublistDefinition(sliding_window_start_index + ind, len(sublist))
-            # cut down list to look for smaller sublist
-            sublist = sublist[:-1]
-        # nothing found
-        return None
-        
-        # -----------------------------------
-
-    def __largest_sublist_search(self, sub_start: int, sub_stop: int, sliding_window_start_index: int, sliding_window_stop_index: int, look_ahead_size: int, min_sublist_size:int) -> SublistDefinition:
-
-        sub_start                   = max(0, sub_start)
-        sliding_window_start_index  = max(0, sliding_window_start_index)
-
-        dat_len                     = len(self.data)
-
-        sub_stop                    = min(dat_len, sub_stop)
-        sliding_window_stop_index   = min(dat_len, sliding_window_stop_index)
-
-        sublist = self.data[sub_start:sub_stop]
-        
-        # ----------------- Iterate ------------------ 30 seconds
-        # max_length = len(sublist)
-        # best_index = -1
-        # best_length = -1
-
-        # # walk through every index in the sliding window
-        # for compare_index in range(sliding_window_start_index, sliding_window_stop_index):
-
-        #     # check to see how many values in the sublist match at this index
-        #     sub_count = 0
-        #     while sub_count < max_length and self.data[compare_index + sub_count] == sublist[sub_count]:
-        #         sub_count += 1
-            
-        #     # record it if it was better than the previous best found
-        #     if sub_count > best_length:
-        #         best_index = compare_index
-        #         best_length = sub_count
-
-        # # only return sublist if it meets the min sublist requirement
-        # if best_length >= min_sublist_size:
-        #     return self.SublistDefinition(offset=best_index, length=best_length)
-        # return None
-        # -----------------------------------
-
-        # ----------------- look for first char ------ 13 seconds
-        sliding_window = self.data[sliding_window_start_index:sliding_window_stop_index]
-
-        first_char = sublist[0]
-        # retrive the indices of all times the first character of the sublist exists in the sliding window
-        all_first_char_inds = [ind for (ind, v) in enumerate(sliding_window) if v == first_char]
-
-
-        # loop over the indices, and figure out how many characters match the sublist
-        all_lengths = [(ArchiveCompressor.__length_of_match(self.data[sliding_window_start_index + ind : sliding_window_start_index + ind + len(sublist)], sublist), ind) for ind in all_first_char_inds]
-        
-        # if no matches are found, return None
-        if len(all_lengths) == 0:
-            return None
-
-        # have to choose 1 of the found, choose the first instance of longest length
-        best_length = max([x[0] for x in all_lengths])
-
-        # if best length isn't long enough, return none
-        if best_length < min_sublist_size:
-            return None
-
-        best_index = min([x[1] for x in all_lengths if x[0] == best_length])
-        return self.SublistDefinition(sliding_window_start_index + best_index, best_length)
-        # -----------------------------------
+        self.max_chain_depth = max_chain_depth
+        self.lazy_matching = lazy_matching
 
     def compress(self) -> bytearray:
-        self.cached_data    = {}
         data_index          = 0
+        data_length         = len(self.data)
         look_back_size      = 2**self.lookback_bit_size
         repetitions_size    = 2**self.repetition_bit_size + 1
+        # shortest match that takes fewer bits than writing its bytes as original data
+        min_sublist_size    = max(2, (1 + self.lookback_bit_size + self.repetition_bit_size) // 9 + 1)
+
+        finder = self.HashChainMatchFinder(self.data, look_back_size, repetitions_size, min_sublist_size, self.max_chain_depth)
 
         buffer = self.CompressedBufferHelper()
-        while data_index < len(self.data):
-                        
-            longest_match = self.__largest_sublist_bytesearch(
-                    sub_start                   = data_index,
-                    sub_stop                    = data_index + repetitions_size,
-                    min_sublist_size            = 2,
-
-                    sliding_window_start_index  = data_index - look_back_size,
-                    sliding_window_stop_index   = data_index,
-                    look_ahead_size             = repetitions_size,
-                )
+        longest_match = finder.find(0)
+        while data_index < data_length:
+            if longest_match != None and self.lazy_matching and longest_match.length < repetitions_size:
+                # lazy matching, if the next byte starts a longer match, write this byte as original data and take that one
+                next_match = finder.find(data_index + 1)
+                if next_match != None and next_match.length > longest_match.length:
+                    buffer.write_original_data(self.data[data_index])
+                    data_index += 1
+                    longest_match = next_match
+                    continue
 
             if longest_match != None:
                 #longest_match.offset is just an index into the array, we actually want to have it become a lookback from the data_index
@@ -428,149 +727,148 @@ class ArchiveCompressor:
             else:
                 buffer.write_original_data(self.data[data_index])
                 data_index += 1
+
+            longest_match = finder.find(data_index)
         
         buffer.flush()
         return buffer.to_byte_array()
 
-class RollingDecompressor():
+class LazyDecompressedBuffer:
+    # reads like a bytearray, but only decodes the stream up to the highest offset that has been read.
+    # Streams with no known size end at their last token, the first invalid one, or max_size
     MAX_SIZE = 4_000_000 # 4 mb max size
 
-    def __init__(self, buffer:bytearray, lookback_bit_count:int, repetition_bit_count:int) -> None:
-        self.bytes_to_decompress = bytearray(buffer)
+    def __init__(self, buffer:bytes, lookback_bit_count:int, repetition_bit_count:int, original_size:int=None, start:int=0, end:int=None, max_size:int=MAX_SIZE) -> None:
+        self.bytes_to_decompress = byte_view(buffer, start, end)
         self.lookback_bit_count = lookback_bit_count
         self.repetition_bit_count = repetition_bit_count
-        self.__reset_buffer()
-        self.outputdata = bytearray()
-    
-    def __read_int(self)->int:
-        if(self.__byte_index + 3 >= len(self.bytes_to_decompress)):
-            raise ValueError("No more ints to read")
-
-        value = int.from_bytes(self.bytes_to_decompress[self.__byte_index : self.__byte_index + 4], 'big')
+        self.original_size = original_size
+        self.max_size = original_size if original_size != None else max_size
+        self.complete = False
 
-        self.__byte_index += 4
+        if lookback_bit_count == 0 and repetition_bit_count == 0:
+            self.__decoder = None
+            self.__data = self.bytes_to_decompress[:original_size] if original_size != None else b''
+            self.complete = True
+        else:
+            self.__decoder = LZStreamDecoder(self.bytes_to_decompress, lookback_bit_count, repetition_bit_count)
+            self.__data = bytearray()
 
-        return value
+    @property
+    def decoded_size(self) -> int:
+        if self.__decoder == None:
+            return len(self.__data)
+        return min(self.__decoder.output_position, self.max_size)
 
-    def __len__(self):
-        return 2**32-1
+    @property
+    def compressed_size(self) -> int:
+        return self.__decoder.byte_index if self.__decoder != None else len(self.__data)
+
+    def decode(self, stop:int) -> int:
+        # makes sure the first stop bytes are decoded, returns how many are
+        stop = min(stop, self.max_size)
+        if self.complete or self.decoded_size >= stop:
+            return self.decoded_size
+
+        decoder = self.__decoder
+        capacity = stop + decoder.max_run_length
+        if len(self.__data) < capacity:
+            # grown into a new array rather than resized, so memoryviews handed out by view stay valid
+            grown = bytearray(max(capacity, 2 * len(self.__data)))
+            grown[:decoder.output_position] = self.__data[:decoder.output_position]
+            self.__data = grown
+
+        try:
+            position = decoder.decode_into(self.__data, stop, self.original_size == None)
+            if position < stop:
+                self.complete = True
+        except ValueError:
+            if self.original_size != None:
+                raise
+            # an unsized stream runs into whatever follows it, the first token that doesn't decode ends it
+            self.complete = True
 
-    def __read_bits(self, bit_count:int):
-        # if enough bits in buffer
-        if bit_count <= self.__bits_in_buffer:
-            # read the bits from the low end
-            value = self.__bit_buffer & (2**bit_count - 1)
-            # rotate out the bits
-            self.__bit_buffer >>= bit_count
-            # remove the count of those bits
-            self.__bits_in_buffer -= bit_count
-        else:
-            # else not enough bits,
-            # we need a new int
-            new_buffer = self.__read_int()
-            
-            new_bits_needed = bit_count - self.__bits_in_buffer
-            # the bits remaining in the buffer will be the high bits for the output data
-            value = self.__bit_buffer << new_bits_needed
+        if decoder.output_position >= self.max_size:
+            self.complete = True
+        return self.decoded_size
 
-            self.__bits_in_buffer = 32 - new_bits_needed
-            # the bits we're using from the new data will become the low bits of the output data
-            value |= (new_buffer & (0xffffffff >> self.__bits_in_buffer))
-            # rotate out the data
-            self.__bit_buffer = new_buffer >> new_bits_needed
+    def __len__(self) -> int:
+        if self.original_size != None:
+            return self.original_size
+        return self.decode(self.max_size)
 
-        return value
-    
-    def __reset_buffer(self):
-        self.__byte_index = 0
-        self.__bit_buffer = 0
-        self.__bits_in_buffer = 0
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                key += len(self)
+            if key < 0 or self.decode(key + 1) <= key:
+                raise IndexError("LazyDecompressedBuffer index out of range")
+            return self.__data[key]
 
-    def decompress(self, size:int):
-        while len(self.outputdata) < size and len(self.outputdata) < RollingDecompressor.MAX_SIZE:
-            # returns 0 or 1
-            head_bit = self.__read_bits(1)
-            if head_bit == CompressionData.REPETITION_DATA:
+        elif isinstance(key, slice):
+            if (key.start or 0) >= 0 and (key.stop == None or key.stop >= 0) and (key.step == None or key.step > 0):
+                start = key.start or 0
+                if key.stop == None:
+                    if key.step == None or key.step == 1:
+                        return LazyDecompressedBuffer.Slice(self, start)
+                    stop = len(self)
+                else:
+                    stop = key.stop
+                stop = min(stop, self.decode(stop))
+                return bytearray(self.__data[start:max(start, stop):key.step])
+
+            # negative bounds and steps need the whole stream
+            start, stop, step = key.indices(self.decode(len(self)))
+            return bytearray(self.__data[:self.decoded_size][start:stop:step])
+
+        raise TypeError(f"Unexpected key: {type(key)}: {key}")
+
+    def unpack_from(self, format_str:str, offset:int=0) -> tuple:
+        # struct.unpack_from over the decoded bytes, decoding just far enough first
+        size = calcsize(format_str)
+        if offset < 0 or self.decode(offset + size) < offset + size:
+            raise struct_error(f"unpack_from requires {size} bytes at offset {offset}, {self.decoded_size} decoded")
+        return unpack_from(format_str, self.__data, offset)
+
+    def view(self, start:int=0, stop:int=None) -> memoryview:
+        # read-only view of decoded bytes. With no stop this is everything decoded so far, nothing more is decoded
+        if stop == None:
+            stop = self.decoded_size
+        else:
+            stop = min(stop, self.decode(stop))
+        return memoryview(self.__data)[start:max(start, stop)].toreadonly()
 
-                far_back = self.__read_bits(self.lookback_bit_count)
-                
-                repetitions = self.__read_bits(self.repetition_bit_count) + 2
+    class Slice:
+        # everything from start onwards, still decoded lazily
+        def __init__(self, buffer:LazyDecompressedBuffer, start:int) -> None:
+            self.buffer = buffer
+            self.start = start
 
-                if far_back > len(self.outputdata):
-                    # if there is a sequence requested to be read that is before the start of the array, then stop
-                    raise ValueError("Invalid data, received too far lookback")
-                while repetitions != 0:
-                    self.outputdata.append(self.outputdata[-1 - far_back])
-                    repetitions -= 1
-            else:
-                self.outputdata.append(self.__read_bits(8))
+        def __len__(self) -> int:
+            return max(len(self.buffer) - self.start, 0)
 
-        return self.outputdata
-    
-    class RollingDecompressorSlice:
-        def __init__(self, d:RollingDecompressor, s:slice) -> None:
-            # we should only get to this point if stop is not defined
-            self.__rolling_decompressor = d
-            self.__slice = s
-        
         def __getitem__(self, key):
             if isinstance(key, int):
-                assert(key >= 0)
-                
-                self.__rolling_decompressor.decompress(max(self.__slice.start, self.__slice.stop))
-                return self.__rolling_decompressor.outputdata[self.__slice.start:self.__slice.stop:self.__slice.step][key]
-            
-            elif isinstance(key, slice):
-                assert(key.step == None or key.step > 0)
-                assert(key.start == None or key.start >= 0)
-                assert(key.stop == None or key.stop >= 0)
-
-                my_start   = self.__slice.start if self.__slice.start != None else 0
-                my_step    = self.__slice.step  if self.__slice.step  != None else 1
+                if key < 0:
+                    key += len(self)
+                if key < 0:
+                    raise IndexError("LazyDecompressedBuffer index out of range")
+                return self.buffer[self.start + key]
 
-                this_start = key.start if key.start != None else 0
-                this_step  = key.step  if key.step  != None else 1
+            elif isinstance(key, slice):
+                if (key.start or 0) >= 0 and (key.stop == None or key.stop >= 0):
+                    return self.buffer[slice(self.start + (key.start or 0), None if key.stop == None else self.start + key.stop, key.step)]
+                start, stop, step = key.indices(len(self))
+                return self.buffer[self.start:self.start + len(self)][start:stop:step]
 
-                if key.stop != None: # stop defined
+            raise TypeError(f"Unexpected key: {type(key)}: {key}")
 
-                    total_start = this_start + my_start
-                    total_end = total_start + max((key.stop - this_start) * my_step, 0)
-                    self.__rolling_decompressor.decompress(max(total_start, total_end))
+        def unpack_from(self, format_str:str, offset:int=0) -> tuple:
+            return self.buffer.unpack_from(format_str, self.start + offset)
 
-                    return self.__rolling_decompressor.outputdata[total_start : total_end : this_step * my_step]
-            
-                elif key.stop == None: # no stop defined
-                    
-                    return RollingDecompressor.RollingDecompressorSlice(self.__rolling_decompressor, slice(my_start + (this_start * this_step), None, this_step*my_step))
-                
-            raise ValueError(f"Unexpected key: {type(key)}: {key}")
-
-        def __len__(self):
-            return len(self.__rolling_decompressor)
-                    
-    def __getitem__(self, key):
-        if isinstance(key, int):
-            assert(key >= 0)
-            
-            self.decompress(key+1)
-            return self.outputdata[key]
+        def view(self, start:int=0, stop:int=None) -> memoryview:
+            return self.buffer.view(self.start + start, None if stop == None else self.start + stop)
 
-        elif isinstance(key, slice):
-            assert(key.step == None or key.step > 0)
-            assert(key.start == None or key.start >= 0)
-            assert(key.stop == None or key.stop >= 0)
-
-            if key.stop != None: # stop defined
-                assert(key.stop >= 0)
-                
-                this_start = key.start if key.start != None else 0
-                
-                self.decompress(max(this_start, key.stop))
-                return self.outputdata[this_start:key.stop:key.step] # return data between start and stop
-                        
-            return RollingDecompressor.RollingDecompressorSlice(self, key) # if no stop defined
-        raise ValueError(f"Unexpected key: {type(key)}: {key}")
-    
 class DataBytesInterpreter:
     @classmethod
     @property
@@ -580,6 +878,13 @@ class DataBytesInterpreter:
     @classmethod
     def parse_bytes_static(cls, all_bytes:bytearray, offset:int, format_str:str):
         struct_size = calcsize(format_str)
+        if isinstance(all_bytes, (LazyDecompressedBuffer, LazyDecompressedBuffer.Slice)) and offset >= 0:
+            # read in place, only decoding as far as the end of the struct
+            try:
+                return all_bytes.unpack_from(format_str, offset)
+            except struct_error:
+                raise ValueError(f'Ran out of bytes to interpret in {cls.__name__}, needed {struct_size} at offset {offset}')
+
         these_bytes = all_bytes[offset:offset+struct_size]
 
         if len(these_bytes) != struct_size:
@@ -653,6 +958,10 @@ class DataEntry(DataBytesInterpreter):
             "footerSize": self.footer_size
         }
     
+    def to_bytes(self) -> bytes:
+        # the entry as it is stored in the offset tables of main.dol and the rels
+        return pack(DataEntry.DATA_FORMAT, self.repetition_bit_size, self.lookback_bit_size, self.original_size | (self.compression_flag << 28), self.disk_location, self.compressed_size)
+
     def from_dict(d:dict) -> DataEntry:
         data = DataEntry(
             pack(
@@ -694,6 +1003,173 @@ class DataEntry(DataBytesInterpreter):
     def __repr__(self) -> str:
         return self.__str__()
 
+# one record per entry laid out exactly like DataEntry.DATA_FORMAT, so a row's bytes are the entry as the game stores it
+DATA_ENTRY_DTYPE = np.dtype([
+    ('padding',             'V2'),
+    ('repetition_bit_size', 'u1'),
+    ('lookback_bit_size',   'u1'),
+    ('size_and_flag',       '>u4'),
+    ('disk_location',       '>u4'),
+    ('compressed_size',     '>u4'),
+])
+
+class DataEntryRow:
+    # a row of a DataEntryTable that reads like a DataEntry without copying anything out of the table
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table:DataEntryTable, index:int) -> None:
+        self.table = table
+        self.index = index
+
+    @property
+    def file(self) -> str:
+        return self.table.file_names[self.table.files[self.index]]
+
+    @property
+    def lookback_bit_size(self) -> int:
+        return int(self.table.lookback_bit_sizes[self.index])
+
+    @property
+    def repetition_bit_size(self) -> int:
+        return int(self.table.repetition_bit_sizes[self.index])
+
+    @property
+    def original_size(self) -> int:
+        return int(self.table.original_sizes[self.index])
+
+    @property
+    def disk_location(self) -> int:
+        return int(self.table.disk_locations[self.index])
+
+    @property
+    def compressed_size(self) -> int:
+        return int(self.table.compressed_sizes[self.index])
+
+    @property
+    def compression_flag(self) -> int:
+        return int(self.table.compression_flags[self.index])
+
+    @property
+    def footer_size(self) -> int:
+        return -(self.disk_location + self.compressed_size) % 0x800
+
+    def to_range(self) -> range:
+        return range(self.disk_location, self.disk_location + self.compressed_size + self.footer_size)
+
+    def to_entry(self) -> DataEntry:
+        return DataEntry(pack(DataEntry.DATA_FORMAT, self.repetition_bit_size, self.lookback_bit_size, self.original_size | (self.compression_flag << 28), self.disk_location, self.compressed_size), 0, self.file)
+
+    def __repr__(self) -> str:
+        return self.to_entry().__repr__()
+
+class DataEntryTable:
+    # DataEntry fields as columns, so whole tables are deduplicated, joined and checked for overlaps at once.
+    # Files are stored as indices into file_names
+    COLUMNS = ['lookback_bit_sizes', 'repetition_bit_sizes', 'original_sizes', 'disk_locations', 'compressed_sizes', 'compression_flags']
+
+    def __init__(self, file_names:list[str], files:np.ndarray, lookback_bit_sizes:np.ndarray, repetition_bit_sizes:np.ndarray, original_sizes:np.ndarray, disk_locations:np.ndarray, compressed_sizes:np.ndarray, compression_flags:np.ndarray) -> None:
+        self.file_names = file_names
+        self.files = np.asarray(files, np.int64)
+        self.lookback_bit_sizes = np.asarray(lookback_bit_sizes, np.int64)
+        self.repetition_bit_sizes = np.asarray(repetition_bit_sizes, np.int64)
+        self.original_sizes = np.asarray(original_sizes, np.int64)
+        self.disk_locations = np.asarray(disk_locations, np.int64)
+        self.compressed_sizes = np.asarray(compressed_sizes, np.int64)
+        self.compression_flags = np.asarray(compression_flags, np.int64)
+
+    @staticmethod
+    def empty() -> DataEntryTable:
+        return DataEntryTable([], *[np.zeros(0, np.int64) for _ in range(7)])
+
+    @staticmethod
+    def from_records(records:np.ndarray, file_name:str) -> DataEntryTable:
+        # records of DATA_ENTRY_DTYPE, all read from file_name
+        size_and_flag = records['size_and_flag'].astype(np.int64)
+        return DataEntryTable([file_name], np.zeros(len(records), np.int64), records['lookback_bit_size'], records['repetition_bit_size'],
+                              size_and_flag & 0xfffffff, records['disk_location'], records['compressed_size'], size_and_flag >> 28)
+
+    @staticmethod
+    def from_buffer(buffer:bytes, offsets:np.ndarray, file_name:str) -> DataEntryTable:
+        # the entry at every offset, offsets don't have to be aligned
+        data = np.frombuffer(byte_view(buffer), np.uint8)
+        offsets = np.asarray(offsets, np.int64)
+        records = data[offsets[:, None] + np.arange(DataEntry.SIZE_OF_STRUCT)].view(DATA_ENTRY_DTYPE).reshape(-1)
+        return DataEntryTable.from_records(records, file_name)
+
+    @staticmethod
+    def from_entries(entries:Iterable[DataEntry]) -> DataEntryTable:
+        entries = list(entries)
+        file_names = sorted(set(x.file for x in entries))
+        file_ids = {x: i for i, x in enumerate(file_names)}
+        return DataEntryTable(file_names, [file_ids[x.file] for x in entries], *[
+            [getattr(x, column[:-1]) for x in entries] for column in DataEntryTable.COLUMNS])
+
+    @staticmethod
+    def concatenate(tables:list[DataEntryTable]) -> DataEntryTable:
+        file_names = sorted(set(x for t in tables for x in t.file_names))
+        if len(file_names) == 0:
+            return DataEntryTable.empty()
+
+        # every table's file indices moved onto the combined file names
+        files = [np.searchsorted(file_names, t.file_names)[t.files] if len(t) > 0 else t.files for t in tables]
+        return DataEntryTable(file_names, np.concatenate(files), *[np.concatenate([getattr(t, column) for t in tables]) for column in DataEntryTable.COLUMNS])
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __getitem__(self, key) -> Union[DataEntryRow, DataEntryTable]:
+        # an integer gives a row view, a mask or index array gives a table of those rows
+        if isinstance(key, (int, np.integer)):
+            key = int(key)
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(f'{DataEntryTable.__name__} index out of range')
+            return DataEntryRow(self, key)
+        return DataEntryTable(self.file_names, self.files[key], *[getattr(self, column)[key] for column in DataEntryTable.COLUMNS])
+
+    def __iter__(self) -> Iterator[DataEntryRow]:
+        return (DataEntryRow(self, i) for i in range(len(self)))
+
+    @property
+    def footer_sizes(self) -> np.ndarray:
+        return -(self.disk_locations + self.compressed_sizes) % 0x800
+
+    @property
+    def range_stops(self) -> np.ndarray:
+        # stop of each entry's to_range()
+        return self.disk_locations + self.compressed_sizes + self.footer_sizes
+
+    def unique(self) -> DataEntryTable:
+        # same rows as putting every entry into a set, ordered by disk location.
+        # The footer size follows from the location and compressed size so it isn't compared
+        if len(self) == 0:
+            return self
+        keys = np.stack([self.disk_locations, self.files] + [getattr(self, x) for x in DataEntryTable.COLUMNS], axis=1)
+        _, first = np.unique(keys, axis=0, return_index=True)
+        return self[first]
+
+    def sorted_by_location(self) -> DataEntryTable:
+        return self[np.argsort(self.disk_locations, kind='stable')]
+
+    def isin(self, other:DataEntryTable) -> np.ndarray:
+        # rows equal to any row of other besides their file name, like equals_besides_filename against each one
+        if len(self) == 0 or len(other) == 0:
+            return np.zeros(len(self), bool)
+        columns = DataEntryTable.COLUMNS
+        keys = np.stack([getattr(self, x) for x in columns], axis=1)
+        other_keys = np.unique(np.stack([getattr(other, x) for x in columns], axis=1), axis=0)
+        # one void value per row so rows compare as a whole
+        row_dtype = np.dtype((np.void, keys.dtype.itemsize * len(columns)))
+        return np.isin(np.ascontiguousarray(keys).view(row_dtype).reshape(-1), np.ascontiguousarray(other_keys).view(row_dtype).reshape(-1))
+
+    def overlaps(self, ranges:MultipleRanges) -> np.ndarray:
+        # MultipleRanges.does_overlap of every row's to_range()
+        return ranges.does_overlap_many(self.disk_locations, self.range_stops)
+
+    def entries(self) -> list[DataEntry]:
+        return [x.to_entry() for x in self]
+
 class FileCache:
     def __init__(self) -> None:
         self.__byte_cache__ = {}
@@ -702,160 +1178,174 @@ class FileCache:
         assert(file_name not in self.__byte_cache__)
 
         with open(file_name, "rb") as f:
-            self.__byte_cache__[file_name] = f.read()
+            # map read-only so every stage and worker process shares the same resident pages
+            if getsize(file_name) == 0:
+                self.__byte_cache__[file_name] = b''
+            else:
+                self.__byte_cache__[file_name] = mmap(f.fileno(), 0, access=ACCESS_READ)
 
-    def get_file_bytes(self, file_name:str)->bytes:
+    def get_file_bytes(self, file_name:str)->Union[mmap, bytes]:
         if file_name not in self.__byte_cache__:
             self.__load_file(file_name)
 
         return self.__byte_cache__[file_name]
+
+file_cache = FileCache()
     
 class MultipleRanges:
+    # disjoint ranges kept as sorted start and stop lists, ranges that overlap or touch are merged
     def __init__(self) -> None:
-        self.__ranges:list[range] = []
+        self.__starts:list[int] = []
+        self.__stops:list[int] = []
+
+    @staticmethod
+    def from_ranges(ranges:Iterable[range]) -> MultipleRanges:
+        # builds in one sorted pass instead of inserting one at a time
+        m = MultipleRanges()
+        for r in sorted(ranges, key=lambda x: x.start):
+            if len(m.__stops) > 0 and r.start <= m.__stops[-1]:
+                m.__stops[-1] = max(m.__stops[-1], r.stop)
+            else:
+                m.__starts.append(r.start)
+                m.__stops.append(r.stop)
+        return m
 
-    def __overlap(r1:range, r2:range):
-        return (
-            # if one of the start/stops exists in the other
-            (r2.start in r1 or r2.stop in r1) or
-            (r1.start in r2 or r1.stop in r2))
-    
-    def __overlap_or_touch(r1:range, r2:range):
-        return (
-            # if they overlap on an edge
-            r1.start == r2.stop or 
-            r2.start == r1.stop or
-            MultipleRanges.__overlap(r1, r2))
-    
-    def __combine_range(r1:range, r2:range)->range:
-        if MultipleRanges.__overlap_or_touch(r1, r2):
-            all_points = [r1.start, r2.start, r1.stop, r2.stop]
-            # if the overlap, just take the max and mins
-            return range(min(all_points), max(all_points))
-        return None
+    @property
+    def ranges(self) -> list[range]:
+        return [range(start, stop) for start, stop in zip(self.__starts, self.__stops)]
+
+    def __len__(self) -> int:
+        return len(self.__starts)
 
     def does_overlap(self, r:range):
-        return any([MultipleRanges.__overlap(x, r) for x in self.__ranges])
+        # a range that only touches one of the ranges counts as overlapping it
+        i = bisect_left(self.__stops, r.start)
+        return i < len(self.__starts) and self.__starts[i] <= r.stop
 
-    def add_range(self, r:range):
+    def does_overlap_many(self, starts:np.ndarray, stops:np.ndarray) -> np.ndarray:
+        # does_overlap of every (start, stop) pair at once
+        range_starts = np.array(self.__starts, np.int64)
+        i = np.searchsorted(np.array(self.__stops, np.int64), starts, 'left')
+        return (i < len(range_starts)) & (range_starts[np.minimum(i, len(range_starts) - 1)] <= stops) if len(range_starts) > 0 else np.zeros(len(starts), bool)
 
-        overlapping_indices = [i for i, this_range in enumerate(self.__ranges) if MultipleRanges.__overlap_or_touch(r, this_range)]
+    def add_range(self, r:range):
+        # every range from the first that ends at or after r.start to the last that starts at or before r.stop
+        i = bisect_left(self.__stops, r.start)
+        j = bisect_right(self.__starts, r.stop)
 
-        if len(overlapping_indices) == 0:
-            self.__ranges.append(r)
+        if i == j:
+            self.__starts.insert(i, r.start)
+            self.__stops.insert(i, r.stop)
         else:
-            # indices should be next to eachother
-            new_range = range(r.start, r.stop)
-            for ind in overlapping_indices:
-                new_range = MultipleRanges.__combine_range(new_range, self.__ranges[ind])
-                assert(new_range != None)
-
-            to_remove_ind = min(overlapping_indices)
-            to_remove_count = len(overlapping_indices)
-            for _ in range(to_remove_count):
-                self.__ranges.pop(to_remove_ind)
-            
-            self.__ranges.append(new_range)
-
-        self.__ranges.sort(key=lambda x: x.start)
+            self.__starts[i:j] = [min(r.start, self.__starts[i])]
+            self.__stops[i:j] = [max(r.stop, self.__stops[j-1])]
 
     def __str__(self) -> str:
-        return f"{self.__ranges}"
+        return f"{self.ranges}"
     
     def __repr__(self) -> str:
         return self.__str__()
 
     def remove_range(self, r:range):
-        new_ranges = []
-
-        for old_range in self.__ranges:
-            if (old_range.start >= r.start and 
-                old_range.stop <= r.stop): # complete overlap, remove
-                pass
-            elif (old_range.start <= r.start and
-                   old_range.stop >= r.start and 
-                   old_range.stop <= r.stop): # overlap top
-                new_ranges.append(range(old_range.start, r.start))
-            elif (old_range.stop >= r.stop and
-                   old_range.start >= r.start and 
-                   old_range.start <= r.stop): # overlap bottom
-                new_ranges.append(range(r.stop, old_range.stop))
-            elif (r.start >= old_range.start and 
-                  r.stop <= old_range.stop): # overlap middle
-                new_ranges.append(range(old_range.start, r.start))
-                new_ranges.append(range(r.stop, old_range.stop))            
-
-        self.__ranges = new_ranges
-
-        self.__ranges.sort(key=lambda x: x.start)
+        # every range with some part inside r
+        i = bisect_right(self.__stops, r.start)
+        j = bisect_left(self.__starts, r.stop)
+        if i >= j:
+            return
+
+        new_starts, new_stops = [], []
+        if self.__starts[i] < r.start:
+            new_starts.append(self.__starts[i])
+            new_stops.append(r.start)
+        if self.__stops[j-1] > r.stop:
+            new_starts.append(r.stop)
+            new_stops.append(self.__stops[j-1])
+
+        self.__starts[i:j] = new_starts
+        self.__stops[i:j] = new_stops
     
     def __contains__(self, value):
-        if len(self.__ranges) == 0:
-            return False 
-        # binary search
-        max_ind = len(self.__ranges)
-        min_ind = 0
-        ind = max_ind // 2
-        while True:
-            this_range = self.__ranges[ind]
-            
-            if value in this_range:
-                return True
-            
-            if ind == min_ind or ind == len(self.__ranges) - 1:
-                return False
-            
-            if value < this_range.start:
-                max_ind = ind
-                ind = (ind + min_ind) // 2
-            elif value > this_range.stop:
-                min_ind = ind
-                ind = (ind + max_ind) // 2
-            elif value == this_range.stop:
-                return False
+        i = bisect_right(self.__starts, value) - 1
+        return i >= 0 and value < self.__stops[i]
             
 class FingerPrintSearcher:
     def __init__(self, b:bytearray, file_name:str) -> None:
         self.data = b
         self.file_name = file_name
 
-    def search_compression(self, lookback:int, repetitions:int) -> set[DataEntry]:
-        to_find = ((repetitions << 8) | lookback).to_bytes(4, 'big')
-        d = self.data
-        
-        found = set()
-
-        ind = d.find(to_find)
-        while ind > 0 and len(d) >= DataEntry.SIZE_OF_STRUCT:
-            entry = DataEntry(d, ind, self.file_name)            
+    @staticmethod
+    def compression_fingerprint(lookback:int, repetitions:int) -> bytes:
+        # first word of a compressed entry, padding then the repetition and lookback bit sizes
+        return ((repetitions << 8) | lookback).to_bytes(4, 'big')
+
+    def find_fingerprints(self, fingerprints:list[bytes]) -> dict[bytes, np.ndarray]:
+        # offsets of every fingerprint, overlapping ones included, found in one pass over the data.
+        # Only offsets with a whole entry after them are kept
+        pattern = re.compile(b'(?=' + b'|'.join(b'(' + re.escape(x) + b')' for x in fingerprints) + b')')
+        last_offset = len(self.data) - DataEntry.SIZE_OF_STRUCT
+
+        matches = np.array([(m.start(), m.lastindex) for m in pattern.finditer(self.data)], np.int64).reshape(-1, 2)
+        matches = matches[matches[:, 0] <= last_offset]
+        return {x: matches[matches[:, 1] == i + 1, 0] for i, x in enumerate(fingerprints)}
+
+    def search(self, compression_formats:list[tuple[int, int]]) -> tuple[set[DataEntry], set[DataEntry]]:
+        # compressed entries of every (lookback, repetitions) format from a single scan, and raw entries
+        compressed, raw = self.search_tables(compression_formats)
+        return set(compressed.entries()), set(raw.entries())
+
+    def search_tables(self, compression_formats:list[tuple[int, int]]) -> tuple[DataEntryTable, DataEntryTable]:
+        # search() without making DataEntry objects, each table is deduplicated and ordered by disk location
+        raw = DataEntryTable.from_buffer(self.data, self.uncompressed_entry_offsets(), self.file_name)
+        if len(compression_formats) == 0:
+            # nothing to search for, and an empty pattern would match everywhere
+            return DataEntryTable.empty(), raw.unique()
+
+        fingerprints = [FingerPrintSearcher.compression_fingerprint(*x) for x in compression_formats]
+        offsets = self.find_fingerprints(fingerprints)
+
+        compressed = self.__compressed_table(np.concatenate([offsets[x] for x in fingerprints]))
+        return compressed.unique(), raw.unique()
+
+    def __compressed_table(self, offsets:np.ndarray) -> DataEntryTable:
+        table = DataEntryTable.from_buffer(self.data, offsets, self.file_name)
+        # for now it has to be a mult of 2048 bytes, and not 0
+        return table[(table.disk_locations % 0x800 == 0) & (table.disk_locations != 0)]
+
+    def __compressed_entries(self, offsets:np.ndarray) -> set[DataEntry]:
+        return set(self.__compressed_table(offsets).entries())
+
+    def uncompressed_entry_offsets(self) -> np.ndarray:
+        # offsets of every raw entry, checked on the data viewed as big endian words at each of the four byte alignments
+        # so DataEntry objects are only made for the ones that pass
+        epsilon = 3
+        view = byte_view(self.data)
+        all_offsets = []
+        for alignment in range(4):
+            words = np.frombuffer(view[alignment : alignment + (len(view) - alignment) // 4 * 4], '>u4')
+            if len(words) < 4:
+                continue
+
+            # an entry is four words, padding and bit sizes, size and flag, disk location, compressed size
+            first_word, sizes, disk_locations, compressed_sizes = words[:-3], words[1:-2], words[2:-1], words[3:]
+            original_sizes = (sizes & 0x0fffffff).astype(np.int64)
+            compressed_sizes = compressed_sizes.astype(np.int64)
+
+            keep = first_word == 0
             # for now it has to be a mult of 2048 bytes, and not 0
-            if entry.disk_location % 0x800 == 0 and entry.disk_location != 0:
-                found.add(entry)
-            
-            d = d[ind + len(to_find):]
-            ind = d.find(to_find)
-        
-        return found
+            keep &= (disk_locations % 0x800 == 0) & (disk_locations != 0)
+            # compressed size and entry size should be close to same size, but not 0
+            keep &= (compressed_sizes > 0) & (original_sizes > 0) & (np.abs(compressed_sizes - original_sizes) <= epsilon)
 
-    def search_uncompressed(self) -> set[DataEntry]:
-        epsilon = 3
-        to_find = (0).to_bytes(4, 'big')
-        d = self.data
-        found = set()
+            all_offsets.append(np.flatnonzero(keep) * 4 + alignment)
 
-        ind = d.find(to_find)
-        while ind >= 0 and len(d[ind:]) >= DataEntry.SIZE_OF_STRUCT:
-            entry = DataEntry(d, ind, self.file_name)
-            
-            # for now it has to be a mult of 2048 bytes, and not 0
-            if entry.disk_location % 0x800 == 0 and entry.disk_location != 0:
-                # compressed size and entry size should be close to same size, but not 0
-                if entry.compressed_size > 0 and entry.original_size > 0 and abs(entry.compressed_size - entry.original_size) <= epsilon:
-                    found.add(entry)
-            
-            d = d[ind + 1:]
-            ind = d.find(to_find)
-        return found
+        return np.sort(np.concatenate(all_offsets)) if len(all_offsets) > 0 else np.zeros(0, np.int64)
+
+    def search_compression(self, lookback:int, repetitions:int) -> set[DataEntry]:
+        to_find = FingerPrintSearcher.compression_fingerprint(lookback, repetitions)
+        return self.__compressed_entries(self.find_fingerprints([to_find])[to_find])
+
+    def search_uncompressed(self) -> set[DataEntry]:
+        return set(DataEntry(self.data, ind, self.file_name) for ind in self.uncompressed_entry_offsets().tolist())
 
 def get_parts_of_file(file_bytes:bytearray):
     found_inds = []
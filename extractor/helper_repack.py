@@ -0,0 +1,278 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+from os.path import join, exists, dirname, basename, splitext, getsize
+from hashlib import blake2b
+import os, json, shutil, progressbar
+from helper_mssb_data import ArchiveCompressor, DataEntry, FingerPrintSearcher, StreamingDecompressor, file_cache, ensure_dir, write_bytes
+
+# (lookback bits, repetition bits) pairs tried when picking a format, the game ships 0b04 and 0e05
+SEARCHED_BIT_SIZES = [(11, 4), (12, 4), (13, 4), (14, 4), (11, 5), (12, 5), (13, 5), (14, 5)]
+
+class CompressionJob(NamedTuple):
+    data: bytes
+    # compressed bytes available, an entry's compressed size plus its footer
+    footprint: int
+    # (lookback bits, repetition bits) pairs to try
+    bit_sizes: list[tuple[int, int]]
+
+class CompressionResult(NamedTuple):
+    lookback_bit_size: int
+    repetition_bit_size: int
+    compressed_bytes: bytes
+    fits: bool
+
+def entry_footprint(entry:DataEntry) -> int:
+    # the sectors an entry owns on disk, from its start up to the next 0x800 boundary
+    return entry.compressed_size + entry.footer_size
+
+def job_for_entry(entry:DataEntry, data:bytes, search_bit_sizes:bool=False) -> CompressionJob:
+    bit_sizes = SEARCHED_BIT_SIZES if search_bit_sizes else [(entry.lookback_bit_size, entry.repetition_bit_size)]
+    return CompressionJob(bytes(data), entry_footprint(entry), bit_sizes)
+
+def compress_with_bit_sizes(data:bytes, lookback_bit_size:int, repetition_bit_size:int) -> bytes:
+    # runs in a worker process
+    return bytes(ArchiveCompressor(data, lookback_bit_size, repetition_bit_size).compress())
+
+def choose_result(job:CompressionJob, outputs:dict[tuple[int, int], bytes]) -> CompressionResult:
+    # smallest output that fits the footprint, or the smallest overall if none do. Ties go to the earlier pair in the job
+    fitting = [x for x in job.bit_sizes if len(outputs[x]) <= job.footprint]
+    lookback, repetition = min(fitting or job.bit_sizes, key=lambda x: len(outputs[x]))
+    return CompressionResult(lookback, repetition, outputs[(lookback, repetition)], len(fitting) > 0)
+
+def compress_batch(jobs:list[CompressionJob], max_workers:int=None) -> list[CompressionResult]:
+    # every (job, bit sizes) pair is its own task, so one large file tried with several formats still spreads across cores
+    max_workers = max_workers or os.cpu_count() or 1
+    outputs = [{} for _ in jobs]
+    tasks = [(i, bit_sizes) for i, job in enumerate(jobs) for bit_sizes in job.bit_sizes]
+
+    if len(tasks) > 0:
+        with ProcessPoolExecutor(max_workers) as executor:
+            # biggest first so a large file doesn't start last and hold up the pool
+            tasks.sort(key=lambda x: -len(jobs[x[0]].data))
+            futures = {executor.submit(compress_with_bit_sizes, jobs[i].data, *bit_sizes): (i, bit_sizes) for i, bit_sizes in tasks}
+
+            for future in progressbar.progressbar(as_completed(futures), max_value=len(futures)):
+                i, bit_sizes = futures[future]
+                outputs[i][bit_sizes] = future.result()
+
+    return [choose_result(job, output) for job, output in zip(jobs, outputs)]
+
+def content_hasher():
+    return blake2b(digest_size=20)
+
+def content_hash(b:bytes) -> str:
+    h = content_hasher()
+    h.update(b)
+    return h.hexdigest()
+
+def find_modified_files(folder:str) -> dict[int, str]:
+    # extracted files are named after their original disk location, {location:08X}.dat, whatever folder they were renamed into
+    modified = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            stem, extension = splitext(name)
+            if extension.lower() == '.dat' and len(stem) == 8:
+                try:
+                    modified[int(stem, 16)] = join(root, name)
+                except ValueError:
+                    pass
+    return modified
+
+def replace_records(table:bytearray, old_record:bytes, new_record:bytes) -> int:
+    # records are DataEntry.to_bytes, 16 bytes (DataEntry.SIZE_OF_STRUCT), found by content rather than a fixed stride
+    count = 0
+    ind = table.find(old_record)
+    while ind != -1:
+        table[ind:ind + len(new_record)] = new_record
+        count += 1
+        ind = table.find(old_record, ind + len(new_record))
+    return count
+
+def place_in_archive(archive_file:str, entry:DataEntry, payload:bytes) -> int:
+    # writes payload over the entry's sectors if it fits, otherwise appends it on the next 0x800 boundary.
+    # Returns where it was written
+    with open(archive_file, 'r+b') as f:
+        if len(payload) <= entry_footprint(entry):
+            offset = entry.disk_location
+            # clear whatever the old data left in the slot
+            padding = entry_footprint(entry) - len(payload)
+        else:
+            f.seek(0, os.SEEK_END)
+            offset = -(-f.tell() // 0x800) * 0x800
+            padding = -len(payload) % 0x800
+
+        f.seek(offset)
+        f.write(payload)
+        f.write(bytes(padding))
+    return offset
+
+def repacked_entry(entry:DataEntry, disk_location:int, original_size:int, compressed_size:int, lookback_bit_size:int, repetition_bit_size:int) -> DataEntry:
+    return DataEntry.from_dict({
+        "Input": entry.file,
+        "Output": entry.output_name,
+        "lookbackBitSize": lookback_bit_size,
+        "repetitionBitSize": repetition_bit_size,
+        "size": original_size,
+        "offset": disk_location,
+        "compressedSize": compressed_size,
+        "compressionFlag": entry.compression_flag,
+    })
+
+class ArchiveRepacker:
+    NAME_FILE_MANIFEST = 'repack.json'
+
+    # the patched main.dol, aaaa.dat and ZZZZ.dat are copies in repack_folder, the originals are never written
+    def __init__(self, main_file:str, aaaa_file:str, zzzz_file:str, results_path:str, repack_folder:str, search_bit_sizes:bool=False, max_workers:int=None) -> None:
+        self.main_file = main_file
+        self.aaaa_file = aaaa_file
+        self.zzzz_file = zzzz_file
+        self.results_path = results_path
+        self.repack_folder = repack_folder
+        self.search_bit_sizes = search_bit_sizes
+        self.max_workers = max_workers
+
+        self.repacked_main_file = join(repack_folder, basename(main_file))
+        self.repacked_aaaa_file = join(repack_folder, basename(aaaa_file))
+        self.repacked_zzzz_file = join(repack_folder, basename(zzzz_file))
+        self.manifest_path = join(repack_folder, self.NAME_FILE_MANIFEST)
+
+    def __prepare_folder(self):
+        ensure_dir(self.repack_folder)
+        for original, repacked in [(self.main_file, self.repacked_main_file), (self.aaaa_file, self.repacked_aaaa_file), (self.zzzz_file, self.repacked_zzzz_file)]:
+            if not exists(repacked):
+                shutil.copyfile(original, repacked)
+
+    def __load_manifest(self) -> dict:
+        # what every entry looked like after the last repack, keyed by its original disk location
+        if exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        return {'Entries': {}, 'Rels': {}}
+
+    def __current_entry(self, section:dict, entry:DataEntry) -> DataEntry:
+        key = f"{entry.disk_location:08X}"
+        if key in section:
+            return DataEntry.from_dict(section[key]['Entry'])
+        return entry
+
+    def __original_hash(self, entry:DataEntry) -> str:
+        archive = file_cache.get_file_bytes(self.zzzz_file)
+        if entry.lookback_bit_size == 0:
+            return content_hash(archive[entry.disk_location : entry.disk_location + entry.compressed_size])
+        # only the hash is needed, so the entry is decompressed a chunk at a time rather than whole
+        decompressor = StreamingDecompressor(archive, entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size, entry.disk_location)
+        return decompressor.update_hash(content_hasher()).hexdigest()
+
+    def __rel_path(self, rel:DataEntry) -> str:
+        return join(dirname(self.results_path), f'{rel.disk_location:x}.rel')
+
+    def __repacked_rel_path(self, rel:DataEntry) -> str:
+        return join(self.repack_folder, f'{rel.disk_location:x}.rel')
+
+    def __find_rels(self) -> list[DataEntry]:
+        # same rels discovery searched, the ones it decompressed next to results.json.
+        # ZZZZ.dat entries share the format, the size of the decompressed rel tells them apart
+        rels = FingerPrintSearcher(file_cache.get_file_bytes(self.main_file), self.aaaa_file).search_compression(11, 4)
+        return sorted([x for x in rels if exists(self.__rel_path(x)) and getsize(self.__rel_path(x)) == x.original_size])
+
+    def __write_changes(self, archive_file:str, changes:list[tuple[DataEntry, DataEntry, bytes]], results:list[CompressionResult]) -> list[DataEntry]:
+        # changes are (original entry, entry as it is now, new contents), results line up with the compressed ones
+        results = iter(results)
+        new_entries = []
+        for _, current, data in changes:
+            if current.lookback_bit_size == 0:
+                payload = data
+                new_entry = repacked_entry(current, place_in_archive(archive_file, current, payload), len(data), len(data), 0, 0)
+            else:
+                result = next(results)
+                payload = result.compressed_bytes
+                new_entry = repacked_entry(current, place_in_archive(archive_file, current, payload), len(data), len(payload), result.lookback_bit_size, result.repetition_bit_size)
+
+            if new_entry.disk_location != current.disk_location:
+                print(f"{current.disk_location:08X} no longer fits, moved to {new_entry.disk_location:08X}")
+            new_entries.append(new_entry)
+        return new_entries
+
+    def __compress_changes(self, changes:list[tuple[DataEntry, DataEntry, bytes]]) -> list[CompressionResult]:
+        jobs = [job_for_entry(current, data, self.search_bit_sizes) for _, current, data in changes if current.lookback_bit_size != 0]
+        return compress_batch(jobs, self.max_workers)
+
+    def repack(self, modified_folder:str) -> list[DataEntry]:
+        # rewrites the referenced ZZZZ.dat entries whose contents changed since the last repack and patches
+        # every offset table that points at them. Returns the rewritten entries
+        self.__prepare_folder()
+        manifest = self.__load_manifest()
+
+        with open(self.results_path, 'r') as f:
+            results = json.load(f)
+        entries = [DataEntry.from_dict(x) for x in results['GameReferencedCompressedFiles'] + results['GameReferencedRawFiles']]
+        entries = [x for x in entries if x.file == self.zzzz_file]
+        modified = find_modified_files(modified_folder)
+
+        print('Hashing modified files...')
+        changes = []
+        hashes = {}
+        for entry in progressbar.progressbar([x for x in entries if x.disk_location in modified]):
+            with open(modified[entry.disk_location], 'rb') as f:
+                data = f.read()
+            key = f"{entry.disk_location:08X}"
+            hashes[key] = content_hash(data)
+
+            previous_hash = manifest['Entries'][key]['Hash'] if key in manifest['Entries'] else self.__original_hash(entry)
+            if hashes[key] != previous_hash:
+                changes.append((entry, self.__current_entry(manifest['Entries'], entry), data))
+
+        if len(changes) == 0:
+            print('Nothing changed')
+            return []
+
+        print(f'Compressing {len(changes)} changed files...')
+        new_entries = self.__write_changes(self.repacked_zzzz_file, changes, self.__compress_changes(changes))
+
+        # the offset tables live in main.dol and in the rels, which are compressed in aaaa.dat
+        with open(self.repacked_main_file, 'rb') as f:
+            main_dol = bytearray(f.read())
+
+        rels = self.__find_rels()
+        rel_tables = {}
+        for rel in rels:
+            rel_path = self.__repacked_rel_path(rel) if exists(self.__repacked_rel_path(rel)) else self.__rel_path(rel)
+            with open(rel_path, 'rb') as f:
+                rel_tables[rel.disk_location] = bytearray(f.read())
+
+        changed_rels = set()
+        for (entry, current, _), new_entry in zip(changes, new_entries):
+            old_record, new_record = current.to_bytes(), new_entry.to_bytes()
+            manifest['Entries'][f"{entry.disk_location:08X}"] = {'Hash': hashes[f"{entry.disk_location:08X}"], 'Entry': new_entry.to_dict()}
+            if old_record == new_record:
+                continue
+
+            patched = replace_records(main_dol, old_record, new_record)
+            for location, table in rel_tables.items():
+                if replace_records(table, old_record, new_record) > 0:
+                    changed_rels.add(location)
+                    patched += 1
+            if patched == 0:
+                print(f"Warning: no offset table entry found for {entry.disk_location:08X}")
+
+        # patched rels go back into aaaa.dat, and their own entries in main.dol are patched in turn
+        rel_changes = []
+        for rel in rels:
+            if rel.disk_location in changed_rels:
+                write_bytes(rel_tables[rel.disk_location], self.__repacked_rel_path(rel))
+                rel_changes.append((rel, self.__current_entry(manifest['Rels'], rel), bytes(rel_tables[rel.disk_location])))
+
+        if len(rel_changes) > 0:
+            print(f'Compressing {len(rel_changes)} changed rels...')
+            new_rels = self.__write_changes(self.repacked_aaaa_file, rel_changes, self.__compress_changes(rel_changes))
+            for (rel, current, data), new_rel in zip(rel_changes, new_rels):
+                manifest['Rels'][f"{rel.disk_location:08X}"] = {'Hash': content_hash(data), 'Entry': new_rel.to_dict()}
+                if replace_records(main_dol, current.to_bytes(), new_rel.to_bytes()) == 0:
+                    print(f"Warning: no main.dol entry found for rel {rel.disk_location:08X}")
+
+        write_bytes(main_dol, self.repacked_main_file)
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        return new_entries
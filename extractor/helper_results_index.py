@@ -0,0 +1,125 @@
+from __future__ import annotations
+from os.path import exists, getmtime, splitext, dirname
+import os, json
+import numpy as np
+from helper_mssb_data import DataEntry, DATA_ENTRY_DTYPE, ensure_dir
+from helper_sector_map import RESULTS_CATEGORIES
+from helper_discovery_cache import STAMP_KEY
+
+assert DATA_ENTRY_DTYPE.itemsize == DataEntry.SIZE_OF_STRUCT
+
+def results_index_path(results_path:str) -> str:
+    return splitext(results_path)[0] + '.npz'
+
+class ResultsIndex:
+    # results.json as columns: the DATA_FORMAT records, the results category of each one
+    # and indices into tables of the input and output names. Loads with one read and
+    # answers offset, category and size queries without building DataEntry objects
+    def __init__(self, records:np.ndarray, categories:np.ndarray, files:np.ndarray, file_names:np.ndarray, outputs:np.ndarray, output_names:np.ndarray, stamp:dict=None) -> None:
+        self.records = records
+        self.categories = categories
+        self.files = files
+        self.file_names = file_names
+        self.outputs = outputs
+        self.output_names = output_names
+        self.stamp = stamp
+        self.__location_order = None
+
+    @staticmethod
+    def from_results(results:dict) -> ResultsIndex:
+        rows = [(category, x) for name, category in RESULTS_CATEGORIES for x in results.get(name, [])]
+
+        records = np.zeros(len(rows), DATA_ENTRY_DTYPE)
+        records['repetition_bit_size'] = [x['repetitionBitSize'] for _, x in rows]
+        records['lookback_bit_size']   = [x['lookbackBitSize'] for _, x in rows]
+        records['size_and_flag']       = [x['size'] | (x['compressionFlag'] << 28) for _, x in rows]
+        records['disk_location']       = [x['offset'] for _, x in rows]
+        records['compressed_size']     = [x['compressedSize'] for _, x in rows]
+
+        file_names, files = np.unique(np.array([x['Input'] for _, x in rows], str), return_inverse=True)
+        # entries written without an output name get the default one back when they're loaded
+        output_names, outputs = np.unique(np.array([x.get('Output', '') for _, x in rows], str), return_inverse=True)
+
+        return ResultsIndex(records, np.array([c for c, _ in rows], np.uint8), files.astype(np.uint32), file_names, outputs.astype(np.uint32), output_names, results.get(STAMP_KEY, None))
+
+    @staticmethod
+    def load(path:str) -> ResultsIndex:
+        with np.load(path, allow_pickle=False) as f:
+            stamp = json.loads(str(f['stamp']))
+            return ResultsIndex(f['records'], f['categories'], f['files'], f['file_names'], f['outputs'], f['output_names'], stamp)
+
+    def save(self, path:str):
+        ensure_dir(dirname(path))
+        # np.savez adds .npz to names that don't end with it, so the temporary file keeps the extension
+        temp_path = f"{splitext(path)[0]}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, records=self.records, categories=self.categories, files=self.files, file_names=self.file_names,
+                 outputs=self.outputs, output_names=self.output_names, stamp=np.array(json.dumps(self.stamp)))
+        os.replace(temp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def original_sizes(self) -> np.ndarray:
+        return self.records['size_and_flag'] & 0xfffffff
+
+    @property
+    def compression_flags(self) -> np.ndarray:
+        return self.records['size_and_flag'] >> 28
+
+    @property
+    def disk_locations(self) -> np.ndarray:
+        return self.records['disk_location']
+
+    def where(self, mask:np.ndarray) -> ResultsIndex:
+        return ResultsIndex(self.records[mask], self.categories[mask], self.files[mask], self.file_names, self.outputs[mask], self.output_names, self.stamp)
+
+    def in_category(self, category:int) -> np.ndarray:
+        return self.categories == category
+
+    def in_file(self, file_name:str) -> np.ndarray:
+        file_id = np.flatnonzero(self.file_names == file_name)
+        return np.isin(self.files, file_id)
+
+    def size_between(self, min_size:int, max_size:int) -> np.ndarray:
+        # original sizes in [min_size, max_size)
+        sizes = self.original_sizes
+        return (sizes >= min_size) & (sizes < max_size)
+
+    def at_offset(self, offset:int) -> np.ndarray:
+        # rows of every entry starting at offset, whatever file or category they're in
+        # the sorted order is worked out on the first lookup and kept, the columns never change after __init__
+        if self.__location_order is None:
+            order = np.argsort(self.disk_locations, kind='stable')
+            self.__location_order = (order, self.disk_locations[order])
+        order, locations = self.__location_order
+        return order[np.searchsorted(locations, offset, 'left'):np.searchsorted(locations, offset, 'right')]
+
+    def entry(self, i:int) -> DataEntry:
+        entry = DataEntry(self.records[i].tobytes(), 0, str(self.file_names[self.files[i]]))
+        output_name = str(self.output_names[self.outputs[i]])
+        if output_name != '':
+            entry.output_name = output_name
+        return entry
+
+    def entries(self) -> list[DataEntry]:
+        return [self.entry(i) for i in range(len(self))]
+
+    def to_results(self) -> dict:
+        # JSON export, shaped like results.json
+        results = {name: [x.to_dict() for x in self.where(self.in_category(category)).entries()] for name, category in RESULTS_CATEGORIES}
+
+        if self.stamp is not None:
+            results[STAMP_KEY] = self.stamp
+        return results
+
+def load_results_index(results_path:str) -> ResultsIndex:
+    # the index is only used while it's at least as new as results.json, which stays the format people edit
+    index_path = results_index_path(results_path)
+    if not exists(index_path) or (exists(results_path) and getmtime(results_path) > getmtime(index_path)):
+        return None
+
+    try:
+        return ResultsIndex.load(index_path)
+    except (OSError, ValueError, KeyError):
+        return None
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import numpy as np
+from helper_mssb_data import DataEntry
+
+SECTOR_SIZE = 0x800
+
+class SECTOR_CATEGORIES():
+    unknown = 0
+    referenced = 1
+    raw = 2
+    unreferenced = 3
+    adgcform = 4
+    category_count = 5
+
+# results.json lists in the order they claim sectors, a sector keeps the first category it gets
+RESULTS_CATEGORIES = [
+    ('GameReferencedCompressedFiles', SECTOR_CATEGORIES.referenced),
+    ('GameReferencedRawFiles',        SECTOR_CATEGORIES.raw),
+    ('UnreferencedCompressedFiles',   SECTOR_CATEGORIES.unreferenced),
+    ('AdGCForms',                     SECTOR_CATEGORIES.adgcform),
+]
+
+class SectorMap:
+    # one category per 0x800 byte sector of an archive
+    def __init__(self, data_length:int) -> None:
+        self.categories = np.zeros(-(-data_length // SECTOR_SIZE), np.uint8)
+
+    @staticmethod
+    def from_results(results:dict, data_length:int, zzzz_file:str=None) -> SectorMap:
+        sector_map = SectorMap(data_length)
+        for name, category in RESULTS_CATEGORIES:
+            entries = [DataEntry.from_dict(x) for x in results.get(name, [])]
+            entries = [x for x in entries if zzzz_file == None or x.file == zzzz_file]
+            # unreferenced entries from before their sizes were found only claim their first sector
+            ranges = [x.to_range() if x.compressed_size > 0 else range(x.disk_location, x.disk_location + 1) for x in entries]
+            sector_map.mark_ranges([x.start for x in ranges], [x.stop for x in ranges], category)
+        return sector_map
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def __sector_bounds(self, starts:np.ndarray, stops:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # first sector and one past the last sector each byte range touches
+        starts = np.asarray(starts, np.int64)
+        stops = np.asarray(stops, np.int64)
+        first = np.clip(starts // SECTOR_SIZE, 0, len(self))
+        last = np.clip(-(-stops // SECTOR_SIZE), 0, len(self))
+        return first, np.maximum(first, last)
+
+    def mark_ranges(self, starts:np.ndarray, stops:np.ndarray, category:int, overwrite:bool=False):
+        # marks every sector any of the byte ranges touch, only unknown sectors unless overwrite is set
+        first, last = self.__sector_bounds(starts, stops)
+        # +1 where each range begins and -1 where it ends, the running sum is how many ranges cover a sector
+        edges = np.zeros(len(self) + 1, np.int64)
+        np.add.at(edges, first, 1)
+        np.add.at(edges, last, -1)
+        covered = np.cumsum(edges[:-1]) > 0
+
+        if not overwrite:
+            covered &= self.categories == SECTOR_CATEGORIES.unknown
+        self.categories[covered] = category
+
+    def mark_range(self, r:range, category:int, overwrite:bool=False):
+        first, last = self.__sector_bounds(r.start, r.stop)
+        sectors = self.categories[int(first):int(last)]
+        if overwrite:
+            sectors[:] = category
+        else:
+            sectors[sectors == SECTOR_CATEGORIES.unknown] = category
+
+    def category_at(self, offsets:np.ndarray) -> np.ndarray:
+        return self.categories[np.asarray(offsets, np.int64) // SECTOR_SIZE]
+
+    def is_mapped(self, offsets:np.ndarray) -> np.ndarray:
+        return self.category_at(offsets) != SECTOR_CATEGORIES.unknown
+
+    def unmapped_sector_offsets(self) -> np.ndarray:
+        return np.flatnonzero(self.categories == SECTOR_CATEGORIES.unknown) * SECTOR_SIZE
@@ -0,0 +1,152 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import os, progressbar
+from helper_mssb_data import ArchiveDecompressor, byte_view, file_cache
+
+RUNNING   = 0
+VALID     = 1
+INVALID   = 2
+# ran past the end of its window, the exact validator decides these
+UNDECIDED = 3
+
+def big_endian_words(buffer:bytes) -> np.ndarray:
+    # zero-copy view of every aligned 32 bit word in the buffer
+    data = byte_view(buffer)
+    return np.frombuffer(data[:len(data) // 4 * 4], dtype='>u4')
+
+class BatchBitReader:
+    # the bit reader of ArchiveDecompressor, run over many streams at once.
+    # every array holds one element per stream that is still being read
+    def __init__(self, words:np.ndarray, first_words:np.ndarray, word_limits:np.ndarray) -> None:
+        self.words = words
+        self.first_words = first_words
+        self.word_limits = word_limits
+        self.bit_buffer = np.zeros(len(first_words), np.uint64)
+        self.bits_in_buffer = np.zeros(len(first_words), np.int64)
+        self.words_read = np.zeros(len(first_words), np.int64)
+        self.out_of_words = np.zeros(len(first_words), bool)
+
+    def keep(self, mask:np.ndarray):
+        self.first_words    = self.first_words[mask]
+        self.word_limits    = self.word_limits[mask]
+        self.bit_buffer     = self.bit_buffer[mask]
+        self.bits_in_buffer = self.bits_in_buffer[mask]
+        self.words_read     = self.words_read[mask]
+        self.out_of_words   = self.out_of_words[mask]
+
+    def read_bits(self, bit_count:np.ndarray) -> np.ndarray:
+        bit_count = np.broadcast_to(np.asarray(bit_count, np.int64), self.bit_buffer.shape)
+        needs_word = self.bits_in_buffer < bit_count
+
+        # streams past their last word get a dummy word and are flagged instead of raising
+        out_of_words = needs_word & (self.words_read >= self.word_limits)
+        self.out_of_words |= out_of_words
+        word_index = np.where(needs_word & ~out_of_words, self.first_words + self.words_read, 0)
+        word = self.words[word_index].astype(np.uint64)
+
+        new_bits_needed = np.where(needs_word, bit_count - self.bits_in_buffer, 0).astype(np.uint64)
+        low_mask = (np.uint64(1) << new_bits_needed) - np.uint64(1)
+        mask = (np.uint64(1) << bit_count.astype(np.uint64)) - np.uint64(1)
+
+        # bits left in the buffer become the high bits of the value when a new word is needed
+        value = np.where(needs_word, (self.bit_buffer << new_bits_needed) | (word & low_mask), self.bit_buffer & mask)
+        self.bit_buffer = np.where(needs_word, word >> new_bits_needed, self.bit_buffer >> bit_count.astype(np.uint64))
+        self.bits_in_buffer = np.where(needs_word, 32 - new_bits_needed.astype(np.int64), self.bits_in_buffer - bit_count)
+        self.words_read += needs_word
+
+        return value.astype(np.int64)
+
+def batch_validate(buffer:bytes, offsets:np.ndarray, lookback_bit_counts:np.ndarray, repetition_bit_counts:np.ndarray, original_sizes:np.ndarray, search_sizes:np.ndarray, token_count:int=64) -> np.ndarray:
+    # same answer as ArchiveDecompressor(buffer, lookback, repetition, original_size, offset, offset + search_size).is_valid_decompression()
+    # for every element. The first token_count tokens of every candidate are checked together, which throws out
+    # most starts, then the survivors go through the exact validator.
+    # Every argument is a per-candidate array, so one pass can mix formats
+    offsets, lookback_bit_counts, repetition_bit_counts, original_sizes, search_sizes = [
+        np.array(x, np.int64) for x in np.broadcast_arrays(offsets, lookback_bit_counts, repetition_bit_counts, original_sizes, search_sizes)]
+    words = big_endian_words(buffer)
+    data_length = len(byte_view(buffer))
+
+    status = np.full(len(offsets), RUNNING, np.int8)
+    ids = np.nonzero(offsets % 4 == 0)[0]
+    # unaligned offsets can't be read as words, leave them to the exact validator
+    status[offsets % 4 != 0] = UNDECIDED
+
+    window_lengths = np.maximum(np.minimum(offsets[ids] + search_sizes[ids], data_length) - offsets[ids], 0)
+    reader = BatchBitReader(words, offsets[ids] // 4, window_lengths // 4)
+    written = np.zeros(len(ids), np.int64)
+
+    for _ in range(token_count):
+        if len(ids) == 0:
+            break
+
+        is_original_data = reader.read_bits(1) == 1
+        # literals read 8 bits and nothing after, repetitions read the lookback then the length
+        first_field = reader.read_bits(np.where(is_original_data, 8, lookback_bit_counts[ids]))
+        second_field = reader.read_bits(np.where(is_original_data, 0, repetition_bit_counts[ids]))
+
+        invalid = ~is_original_data & (first_field >= written)
+        written += np.where(is_original_data, 1, second_field + 2)
+
+        finished = np.full(len(ids), RUNNING, np.int8)
+        finished[written >= original_sizes[ids]] = VALID
+        finished[invalid] = INVALID
+        finished[reader.out_of_words] = UNDECIDED
+
+        status[ids] = finished
+        still_running = finished == RUNNING
+        ids = ids[still_running]
+        written = written[still_running]
+        reader.keep(still_running)
+
+    for i in np.nonzero((status == RUNNING) | (status == UNDECIDED))[0]:
+        offset = int(offsets[i])
+        if ArchiveDecompressor(buffer, int(lookback_bit_counts[i]), int(repetition_bit_counts[i]), int(original_sizes[i]), offset, offset + int(search_sizes[i])).is_valid_decompression():
+            status[i] = VALID
+        else:
+            status[i] = INVALID
+
+    return status == VALID
+
+def batch_validate_formats(buffer:bytes, offsets:np.ndarray, formats:list[tuple[int, int, int]], token_count:int=64) -> np.ndarray:
+    # checks every offset against every (lookback, repetition, size) format in one pass over the sectors,
+    # returns a formats x offsets array of which ones validated
+    offsets = np.asarray(offsets, np.int64)
+    format_array = np.array(formats, np.int64).reshape(-1, 3)
+
+    repeated_offsets = np.tile(offsets, len(format_array))
+    per_candidate = np.repeat(format_array, len(offsets), axis=0)
+    lookback_bit_counts, repetition_bit_counts, original_sizes = per_candidate.T
+
+    valid = batch_validate(buffer, repeated_offsets, lookback_bit_counts, repetition_bit_counts, original_sizes, 2*original_sizes, token_count)
+    return valid.reshape(len(format_array), len(offsets))
+
+def scan_shard(file_name:str, offsets:np.ndarray, formats:list[tuple[int, int, int]]) -> np.ndarray:
+    # runs in a worker process, the archive is mapped read-only there so no bytes are sent between processes
+    return batch_validate_formats(file_cache.get_file_bytes(file_name), offsets, formats)
+
+def scan_sectors(file_name:str, offsets:np.ndarray, formats:list[tuple[int, int, int]], max_workers:int=None, shards_per_worker:int=4) -> np.ndarray:
+    # brute force checks every offset against every (lookback, repetition, size) format across a process pool,
+    # each shard is read once for all formats. Returns a formats x offsets array of every format that validated
+    offsets = np.asarray(offsets, np.int64)
+    max_workers = max_workers or os.cpu_count() or 1
+    shards = [x for x in np.array_split(np.arange(len(offsets)), max_workers * shards_per_worker) if len(x) > 0]
+
+    valid = np.zeros((len(formats), len(offsets)), bool)
+    if len(offsets) > 0:
+        with ProcessPoolExecutor(max_workers) as executor:
+            futures = {executor.submit(scan_shard, file_name, offsets[shard], formats): shard for shard in shards}
+
+            for future in progressbar.progressbar(as_completed(futures), max_value=len(futures)):
+                valid[:, futures[future]] = future.result()
+
+    return valid
+
+def first_valid_format(valid:np.ndarray) -> np.ndarray:
+    # keeps only the first format that validated each offset, like checking the formats one after another
+    valid = valid.copy()
+    already_found = np.zeros(valid.shape[1], bool)
+    for format_valid in valid:
+        format_valid &= ~already_found
+        already_found |= format_valid
+    return valid
@@ -0,0 +1,141 @@
+from __future__ import annotations
+from typing import NamedTuple
+from bisect import bisect_right
+from struct import Struct
+from zlib import crc32
+from os.path import dirname, join, exists
+from helper_mssb_data import LZStreamDecoder, DataEntry, byte_view, write_bytes, file_cache
+from helper_decompression_cache import decompression_cache
+
+class SeekCheckpoint(NamedTuple):
+    output_offset: int
+    byte_index: int
+    bit_buffer: int
+    bits_in_buffer: int
+    # the last 2**lookback_bit_count bytes of output before output_offset
+    window: bytes
+
+class SeekIndex:
+    DEFAULT_INTERVAL = 0x10000
+    MAGIC = b'MSKI'
+    # magic, lookback bits, repetition bits, interval, indexed size, compressed size, crc32 of the compressed bytes, checkpoint count
+    HEADER = Struct('>4sBBIIIII')
+    # output offset, byte index, bit buffer, bits in buffer, window size
+    CHECKPOINT = Struct('>IIIII')
+
+    def __init__(self, lookback_bit_count:int, repetition_bit_count:int, interval:int, size:int, compressed_size:int, checksum:int, checkpoints:list[SeekCheckpoint]) -> None:
+        self.lookback_bit_count = lookback_bit_count
+        self.repetition_bit_count = repetition_bit_count
+        self.interval = interval
+        self.size = size
+        self.compressed_size = compressed_size
+        self.checksum = checksum
+        self.checkpoints = checkpoints
+        self.__offsets = [x.output_offset for x in checkpoints]
+
+    @staticmethod
+    def build(buffer:bytes, lookback_bit_count:int, repetition_bit_count:int, size:int, start:int=0, end:int=None, interval:int=DEFAULT_INTERVAL) -> tuple[SeekIndex, bytearray]:
+        # decompresses the first size bytes of the stream, recording a checkpoint every interval bytes of output
+        source = byte_view(buffer, start, end)
+        decoder = LZStreamDecoder(source, lookback_bit_count, repetition_bit_count)
+        window_size = 1 << lookback_bit_count
+
+        out = bytearray()
+        checkpoints = [SeekCheckpoint(0, 0, 0, 0, b'')]
+        while decoder.output_position < size:
+            target = min(size, (decoder.output_position // interval + 1) * interval)
+            position = decoder.decode_into(out, target)
+            if position < size:
+                byte_index, bit_buffer, bits_in_buffer = decoder.get_state()
+                checkpoints.append(SeekCheckpoint(position, byte_index, bit_buffer, bits_in_buffer, bytes(out[max(0, position - window_size):position])))
+        del out[decoder.output_position:]
+
+        compressed_size = decoder.byte_index
+        index = SeekIndex(lookback_bit_count, repetition_bit_count, interval, size, compressed_size, crc32(source[:compressed_size]), checkpoints)
+        return index, out
+
+    def matches(self, buffer:bytes, start:int=0, end:int=None) -> bool:
+        source = byte_view(buffer, start, end)
+        return len(source) >= self.compressed_size and crc32(source[:self.compressed_size]) == self.checksum
+
+    def decompress_range(self, buffer:bytes, output_start:int, output_stop:int, start:int=0, end:int=None) -> bytearray:
+        # decodes only from the closest checkpoint at or before output_start
+        output_stop = min(output_stop, self.size)
+        if output_start >= output_stop:
+            return bytearray()
+
+        checkpoint = self.checkpoints[bisect_right(self.__offsets, output_start) - 1]
+        # out starts with the window, so output offsets are shifted by base
+        base = checkpoint.output_offset - len(checkpoint.window)
+
+        decoder = LZStreamDecoder(byte_view(buffer, start, end), self.lookback_bit_count, self.repetition_bit_count)
+        decoder.set_state(checkpoint.byte_index, checkpoint.bit_buffer, checkpoint.bits_in_buffer, len(checkpoint.window))
+        out = bytearray(checkpoint.window)
+        decoder.decode_into(out, output_stop - base)
+
+        return out[output_start - base : output_stop - base]
+
+    def to_bytes(self) -> bytes:
+        b = bytearray(self.HEADER.pack(self.MAGIC, self.lookback_bit_count, self.repetition_bit_count, self.interval, self.size, self.compressed_size, self.checksum, len(self.checkpoints)))
+        for c in self.checkpoints:
+            b.extend(self.CHECKPOINT.pack(c.output_offset, c.byte_index, c.bit_buffer, c.bits_in_buffer, len(c.window)))
+            b.extend(c.window)
+        return bytes(b)
+
+    @staticmethod
+    def from_bytes(b:bytes) -> SeekIndex:
+        magic, lookback_bit_count, repetition_bit_count, interval, size, compressed_size, checksum, count = SeekIndex.HEADER.unpack_from(b, 0)
+        if magic != SeekIndex.MAGIC:
+            raise ValueError("Not a seek index")
+
+        offset = SeekIndex.HEADER.size
+        checkpoints = []
+        for _ in range(count):
+            output_offset, byte_index, bit_buffer, bits_in_buffer, window_size = SeekIndex.CHECKPOINT.unpack_from(b, offset)
+            offset += SeekIndex.CHECKPOINT.size
+            checkpoints.append(SeekCheckpoint(output_offset, byte_index, bit_buffer, bits_in_buffer, bytes(b[offset:offset + window_size])))
+            offset += window_size
+
+        return SeekIndex(lookback_bit_count, repetition_bit_count, interval, size, compressed_size, checksum, checkpoints)
+
+    def save(self, file_path:str):
+        write_bytes(self.to_bytes(), file_path)
+
+    @staticmethod
+    def load(file_path:str) -> SeekIndex:
+        with open(file_path, 'rb') as f:
+            return SeekIndex.from_bytes(f.read())
+
+def seek_index_path(results_path:str, entry:DataEntry) -> str:
+    # indices live in a folder next to results.json
+    return join(dirname(results_path), 'seek index', f"{entry.disk_location:08X}.idx")
+
+def load_seek_index(archive:bytes, entry:DataEntry, results_path:str) -> SeekIndex:
+    file_path = seek_index_path(results_path, entry)
+    if not exists(file_path):
+        return None
+
+    index = SeekIndex.load(file_path)
+    if (index.lookback_bit_count, index.repetition_bit_count) != (entry.lookback_bit_size, entry.repetition_bit_size) or not index.matches(archive, entry.disk_location):
+        return None
+    return index
+
+def build_seek_index(archive:bytes, entry:DataEntry, results_path:str, interval:int=SeekIndex.DEFAULT_INTERVAL) -> tuple[SeekIndex, bytearray]:
+    index, decompressed_bytes = SeekIndex.build(archive, entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size, entry.disk_location, interval=interval)
+    index.save(seek_index_path(results_path, entry))
+    return index, decompressed_bytes
+
+def decompress_entry_range(entry:DataEntry, results_path:str, output_start:int, output_stop:int) -> bytearray:
+    # decompresses part of an entry, the first call builds and saves its seek index with a full decode
+    key = decompression_cache.key(entry.file, entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size, entry.disk_location)
+    payload = decompression_cache.get(key)
+    if payload is not None:
+        return bytearray(payload[output_start:min(output_stop, entry.original_size)])
+
+    archive = file_cache.get_file_bytes(entry.file)
+    index = load_seek_index(archive, entry, results_path)
+    if index is None:
+        index, decompressed_bytes = build_seek_index(archive, entry, results_path)
+        decompression_cache.put(key, decompressed_bytes)
+        return decompressed_bytes[output_start:min(output_stop, index.size)]
+    return index.decompress_range(archive, output_start, output_stop, entry.disk_location)
@@ -1,17 +1,23 @@
-from helper_mssb_data import DataEntry, RollingDecompressor, ensure_dir, write_bytes, ArchiveDecompressor, get_parts_of_file, write_text
+from helper_mssb_data import DataEntry, LazyDecompressedBuffer, ensure_dir, write_bytes, ArchiveDecompressor, get_parts_of_file, write_text, file_cache
 from os.path import join, exists
 from os import rename
 from run_extract_Texture import export_images
 from run_extract_Model import *
 from run_extract_Actor import export_actor
-from run_file_discovery import discover_US_files, discover_beta_files, discover_JP_files, discover_EU_files, discover_family_files
+from helper_discovery_cache import is_stamp_current, is_archive_stamp_current
+from helper_results_index import ResultsIndex, load_results_index, results_index_path
+from helper_sector_map import SECTOR_CATEGORIES
+from run_file_discovery import discover_US_files, discover_beta_files, discover_JP_files, discover_EU_files, discover_family_files, resolve_unreferenced_sizes
 import json, progressbar, traceback, os, shutil
+from typing import NamedTuple, Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from run_draw_pic import draw_pic
 from helper_file_system import *
 from helper_c3 import SECTION_TYPES, SECTION_TEMPLATES
 from helper_c3_export import *
 from run_extract_Collision import export_collision
 from helper_x3d import x3d_export
+from helper_decompression_cache import cached_decompress
 
 def try_export_texture(b, new_out_folder, part) -> tuple[bool, str, dict]:
     try:
@@ -140,6 +146,22 @@ def interpret_bytes(b:bytearray, output_folder:str, format:str):
         # obj_export(output_folder, export_groups)
         x3d_export(output_folder, export_groups)
 
+class Version(NamedTuple):
+    name:str
+    output_folder:str
+    results_path:str
+    zzzz_file:str
+    discovery_method:Callable
+    file_name_path:str
+
+VERSIONS = [
+    Version('US',     US_OUTPUT_FOLDER,     US_RESULTS_FILE,     US_ZZZZ_FILE,     discover_US_files,     US_CUSTOM_FILENAMES),
+    Version('JP',     JP_OUTPUT_FOLDER,     JP_RESULTS_FILE,     JP_ZZZZ_FILE,     discover_JP_files,     JP_CUSTOM_FILENAMES),
+    Version('EU',     EU_OUTPUT_FOLDER,     EU_RESULTS_FILE,     EU_ZZZZ_FILE,     discover_EU_files,     EU_CUSTOM_FILENAMES),
+    Version('Beta',   BETA_OUTPUT_FOLDER,   BETA_RESULTS_FILE,   BETA_ZZZZ_FILE,   discover_beta_files,   BETA_CUSTOM_FILENAMES),
+    Version('family', FAMILY_OUTPUT_FOLDER, FAMILY_RESULTS_FILE, FAMILY_ZZZZ_FILE, discover_family_files, FAMILY_CUSTOM_FILENAMES),
+]
+
 def interpret_US():
     print('Looking at US files...')
     return interpret_version(US_OUTPUT_FOLDER, US_RESULTS_FILE, US_ZZZZ_FILE, discover_US_files, US_CUSTOM_FILENAMES)
@@ -157,33 +179,70 @@ def interpret_family():
     return interpret_version(FAMILY_OUTPUT_FOLDER, FAMILY_RESULTS_FILE, FAMILY_ZZZZ_FILE, discover_family_files, FAMILY_CUSTOM_FILENAMES)
 
 def main():
-    interpret_US()
-    interpret_JP()
-    interpret_EU()
-    interpret_BETA()
-    interpret_family()
-    
-def interpret_version(output_folder:str, results_path:str, zzzz_file:str, discovery_method, file_name_path:str):
-    REFERENCED_FOLDER = join(output_folder, 'Referenced files')
-    UNREFERENCED_FOLDER = join(output_folder, 'Unreferenced files')
-    RAW_FOLDER = join(output_folder, 'Raw files')
-    ADGCFORMS_FOLDER = join(output_folder, 'AdGCForms')
-
+    interpret_versions(VERSIONS)
+
+# the order entries are extracted in, the folder each kind goes in and what's printed before them
+EXTRACTION_STAGES = [
+    (SECTOR_CATEGORIES.referenced,   'Referenced files',   "Interpreting referenced compressed files... (should take about 10 minutes)"),
+    (SECTOR_CATEGORIES.unreferenced, 'Unreferenced files', "Interpreting unreferenced compressed files... (this will take 30-45 minutes)"),
+    (SECTOR_CATEGORIES.adgcform,     'AdGCForms',          "Interpreting AdGCForms files..."),
+    (SECTOR_CATEGORIES.raw,          'Raw files',          "Interpreting referenced raw files..."),
+]
+
+class ExtractionJob(NamedTuple):
+    # one entry to extract, with everything a worker process needs to do it
+    zzzz_file:str
+    category:int
+    entry:DataEntry
+    folder:str
+    output_file_name:str
+    format:str
+
+def load_results(output_folder:str, results_path:str, zzzz_file:str, discovery_method, use_results_index:bool=True) -> ResultsIndex:
     if not exists(zzzz_file):
-        return
+        return None
 
     ensure_dir(output_folder)
 
-    with open(zzzz_file, 'rb') as f:
-        ZZZZ_DAT = f.read()
- 
-    if exists(results_path): 
-        with open(results_path, 'r') as f:
-            found_files = json.load(f)
-    else:
-        found_files = discovery_method()
-        draw_pic(zzzz_file, results_path, join(output_folder, "results.png"))
-        
+    # the binary index loads in one read, results.json is only parsed when the index is missing or older
+    results_index = load_results_index(results_path) if use_results_index else None
+    if results_index is not None and not is_archive_stamp_current(results_index.stamp):
+        results_index = None
+
+    if results_index is None:
+        found_files = None
+        if exists(results_path):
+            with open(results_path, 'r') as f:
+                found_files = json.load(f)
+
+            if not is_stamp_current(found_files):
+                print(f'{results_path} was discovered from different archives, discovering files again...')
+                found_files = None
+
+            # results from before unreferenced sizes were recorded
+            elif any(x['compressedSize'] == 0 for x in found_files['UnreferencedCompressedFiles']):
+                print('Finding the end of unreferenced compressed data...')
+                resolve_unreferenced_sizes(found_files, zzzz_file)
+                with open(results_path, "w") as f:
+                    json.dump(found_files, f, indent=2)
+
+        if found_files is None:
+            found_files = discovery_method()
+            draw_pic(zzzz_file, results_path, join(output_folder, "results.png"))
+
+        results_index = ResultsIndex.from_results(found_files)
+        if use_results_index:
+            results_index.save(results_index_path(results_path))
+
+    # only entries in this archive get extracted
+    return results_index.where(results_index.in_file(zzzz_file))
+
+def extraction_jobs(output_folder:str, results_path:str, zzzz_file:str, discovery_method, file_name_path:str, use_results_index:bool=True) -> list[ExtractionJob]:
+    # every entry of the version that hasn't been extracted yet, in EXTRACTION_STAGES order
+    results_index = load_results(output_folder, results_path, zzzz_file, discovery_method, use_results_index)
+    if results_index is None:
+        return []
+
     if exists(file_name_path):
         with open(file_name_path, 'r') as f:
             file_names = json.load(f)
@@ -193,105 +252,127 @@ def interpret_version(output_folder:str, results_path:str, zzzz_file:str, discov
         offset_to_name = {}
         offset_to_format = {}
 
-    def mean(x):
-        return sum(x) // len(x) 
-
-    def process_files(files, folder):
-        for json_entry in progressbar.progressbar(files):
-            entry = DataEntry.from_dict(json_entry)
-            if entry.file != zzzz_file:
-                continue
-
+    jobs = []
+    for category, folder_name, _ in EXTRACTION_STAGES:
+        for entry in results_index.where(results_index.in_category(category)).entries():
             location = f"{entry.disk_location:08X}"
             default_folder_name = location
             renamed_folder = offset_to_name.get(entry.disk_location, default_folder_name)
 
-            this_folder = join(folder, renamed_folder)
-            ensure_dir(this_folder)
+            this_folder = join(output_folder, folder_name, renamed_folder)
             output_file_name = join(this_folder, f"{location}.dat")
-            this_format = offset_to_format.get(entry.disk_location, None)
-            if folder == REFERENCED_FOLDER:
-                if not exists(output_file_name):
-                    this_data = ZZZZ_DAT[entry.disk_location : entry.disk_location + entry.compressed_size]
-                    if len(this_data) == entry.compressed_size:
-                        decompressed_bytes = ArchiveDecompressor(ZZZZ_DAT[entry.disk_location:], entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size).decompress()
-
-                        interpret_bytes(decompressed_bytes, this_folder, this_format)
-
-                        write_bytes(decompressed_bytes, output_file_name)
-            elif folder == UNREFERENCED_FOLDER:
-                mean = lambda x : sum(x) // len(x) 
-                if not exists(output_file_name):
-                    decompressor = RollingDecompressor(ZZZZ_DAT[entry.disk_location:], entry.lookback_bit_size, entry.repetition_bit_size)
-                    parts_of_file = get_parts_of_file(decompressor)
-                    
-                    if len(parts_of_file) > 1:
-                        if len(parts_of_file) > 0 and parts_of_file[0] == 80_92_000: # base address is a c3 file
-                            parts_of_file = []
-                        else:
-                            # calculate the average size of a section, and decompress that much past the last part start
-                            # hopefully should allow for faster decompressing
-                            average_size = mean([parts_of_file[x+1] - parts_of_file[x] for x in range(len(parts_of_file) - 1)])
-                            try:
-                                decompressed_bytes = decompressor[0:parts_of_file[-1] + average_size]
-                            except:
-                                decompressed_bytes = decompressor
-                    else:
-                        decompressed_bytes = decompressor
-
-                    interpret_bytes(decompressed_bytes, this_folder, this_format)
-
-                    write_bytes(decompressor.outputdata, output_file_name)
-            elif ADGCFORMS_FOLDER:
-                if not exists(output_file_name):
-
-                    if entry.compression_flag == 0:
-                        these_bytes = ZZZZ_DAT[entry.disk_location : entry.disk_location + entry.original_size]
-                    else:
-                        these_bytes = ArchiveDecompressor(ZZZZ_DAT[entry.disk_location:], entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size).decompress()
-
-                    interpret_bytes(these_bytes, this_folder, this_format)
-
-                    write_bytes(these_bytes, output_file_name)
-
-            elif folder == RAW_FOLDER:
-                if not exists(output_file_name):
-                    these_bytes = ZZZZ_DAT[entry.disk_location:entry.disk_location+entry.compressed_size]
-
-                    interpret_bytes(these_bytes, this_folder, this_format)
-
-                    write_bytes(these_bytes, output_file_name)
-            # if not exists(output_file_name):
-            #     if entry.compression_flag == 0:
-            #         these_bytes = ZZZZ_DAT[entry.disk_location: entry.disk_location + entry.original_size]
-            #         write_bytes(these_bytes, output_file_name)
-            #     else:
-            #         decompressed_bytes = ArchiveDecompressor(ZZZZ_DAT[entry.disk_location:], entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size).decompress()
-            #         this_format = offset_to_format.get(entry.disk_location, None)
-            #         interpret_bytes(decompressed_bytes, this_folder, this_format)
-            #         write_bytes(decompressed_bytes, output_file_name)
-            #     # Calculate the mean size of sections for faster decompression
-            #     parts_of_file = get_parts_of_file(decompressed_bytes)
-            #     if len(parts_of_file) > 1:
-            #         average_size = mean([parts_of_file[x+1] - parts_of_file[x] for x in range(len(parts_of_file) - 1)])
-            #         try:
-            #             decompressed_bytes = decompressed_bytes[:parts_of_file[-1] + average_size]
-            #         except:
-            #             decompressed_bytes = decompressed_bytes
-            #     interpret_bytes(decompressed_bytes, this_folder, this_format)
-            #     write_bytes(decompressed_bytes, output_file_name)
-
-    print("Interpreting referenced compressed files... (should take about 10 minutes)")
-    process_files(found_files['GameReferencedCompressedFiles'], REFERENCED_FOLDER)
-
-    print("Interpreting unreferenced compressed files... (this will take 30-45 minutes)")
-    process_files(found_files['UnreferencedCompressedFiles'], UNREFERENCED_FOLDER)
-
-    print("Interpreting AdGCForms files...")
-    process_files(found_files['AdGCForms'], ADGCFORMS_FOLDER)
-
-    print("Interpreting referenced raw files...")
-    process_files(found_files['GameReferencedRawFiles'], RAW_FOLDER)
+            if exists(output_file_name):
+                continue
+
+            jobs.append(ExtractionJob(zzzz_file, category, entry, this_folder, output_file_name, offset_to_format.get(entry.disk_location, None)))
+    return jobs
+
+def extract_entry(job:ExtractionJob):
+    # module level so worker processes can run it, the archive is mapped in each worker rather than sent to it
+    ZZZZ_DAT = file_cache.get_file_bytes(job.zzzz_file)
+    entry = job.entry
+    ensure_dir(job.folder)
+
+    if job.category == SECTOR_CATEGORIES.referenced:
+        if entry.disk_location + entry.compressed_size <= len(ZZZZ_DAT):
+            decompressed_bytes = cached_decompress(job.zzzz_file, entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size, entry.disk_location)
+
+            interpret_bytes(decompressed_bytes, job.folder, job.format)
+
+            write_bytes(decompressed_bytes, job.output_file_name)
+    elif job.category == SECTOR_CATEGORIES.unreferenced:
+        if entry.original_size != 0:
+            decompressed_bytes = cached_decompress(job.zzzz_file, entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size, entry.disk_location, entry.disk_location + entry.compressed_size)
+
+            interpret_bytes(decompressed_bytes, job.folder, job.format)
+
+            write_bytes(decompressed_bytes, job.output_file_name)
+        else:
+            # the size isn't known, so only as much as the parsers read gets decompressed
+            decompressed_bytes = LazyDecompressedBuffer(ZZZZ_DAT, entry.lookback_bit_size, entry.repetition_bit_size, None, entry.disk_location)
+
+            interpret_bytes(decompressed_bytes, job.folder, job.format)
+
+            write_bytes(decompressed_bytes.view(), job.output_file_name)
+    elif job.category == SECTOR_CATEGORIES.adgcform:
+        if entry.compression_flag == 0:
+            these_bytes = ZZZZ_DAT[entry.disk_location : entry.disk_location + entry.original_size]
+        else:
+            these_bytes = cached_decompress(job.zzzz_file, entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size, entry.disk_location)
+
+        interpret_bytes(these_bytes, job.folder, job.format)
+
+        write_bytes(these_bytes, job.output_file_name)
+
+    elif job.category == SECTOR_CATEGORIES.raw:
+        these_bytes = ZZZZ_DAT[entry.disk_location:entry.disk_location+entry.compressed_size]
+
+        interpret_bytes(these_bytes, job.folder, job.format)
+
+        write_bytes(these_bytes, job.output_file_name)
+
+def interpret_versions(versions:list[Version], max_workers:int=None):
+    # discovery runs one version at a time since it already spreads its scans over every core.
+    # Then the entries of every version share one pool, so the whole run takes about the total work over the core count
+    jobs:list[ExtractionJob] = []
+    job_versions:list[Version] = []
+    for version in versions:
+        if not exists(version.zzzz_file):
+            continue
+        print(f'Looking at {version.name} files...')
+        these_jobs = extraction_jobs(version.output_folder, version.results_path, version.zzzz_file, version.discovery_method, version.file_name_path)
+        jobs.extend(these_jobs)
+        job_versions.extend([version] * len(these_jobs))
+
+    if len(jobs) == 0:
+        return
+
+    remaining = {x.name: 0 for x in job_versions}
+    for version in job_versions:
+        remaining[version.name] += 1
+    extracted = {x: 0 for x in remaining}
+    errors = {x: [] for x in remaining}
+
+    # largest entries first, so the run doesn't end waiting on one big entry that started last
+    order = sorted(range(len(jobs)), key=lambda i: jobs[i].entry.original_size, reverse=True)
+
+    print(f'Interpreting {len(jobs)} files from {", ".join(f"{k} ({v})" for k, v in remaining.items())}...')
+    bar = progressbar.ProgressBar(max_value=len(jobs), redirect_stdout=True)
+    bar.start()
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(extract_entry, jobs[i]): i for i in order}
+
+        for done, future in enumerate(as_completed(futures)):
+            i = futures[future]
+            name = job_versions[i].name
+            # one entry failing doesn't stop its version or any other
+            try:
+                future.result()
+                extracted[name] += 1
+            except Exception:
+                errors[name].append(f'{jobs[i].output_file_name}\n{traceback.format_exc()}')
+
+            remaining[name] -= 1
+            if remaining[name] == 0:
+                print(f'{name} files done, {extracted[name]} interpreted, {len(errors[name])} failed')
+            bar.update(done + 1)
+    bar.finish()
+
+    # each version's failures are kept in its own output folder
+    for version in versions:
+        if len(errors.get(version.name, [])) > 0:
+            write_text('\n'.join(errors[version.name]), join(version.output_folder, 'extraction errors.txt'))
+
+def interpret_version(output_folder:str, results_path:str, zzzz_file:str, discovery_method, file_name_path:str, use_results_index:bool=True):
+    if not exists(zzzz_file):
+        return
+
+    jobs = extraction_jobs(output_folder, results_path, zzzz_file, discovery_method, file_name_path, use_results_index)
+
+    for category, _, message in EXTRACTION_STAGES:
+        print(message)
+        for job in progressbar.progressbar([x for x in jobs if x.category == category]):
+            extract_entry(job)
 
         # if not exists(output_file_name):
         #     if entry.compression_flag == 0:
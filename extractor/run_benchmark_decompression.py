@@ -0,0 +1,101 @@
+from helper_mssb_data import ArchiveCompressor, ArchiveDecompressor, DataEntry
+from helper_file_system import *
+from os.path import exists
+import json, random, time
+
+def reference_decompress(buffer:bytes, lookback_bit_count:int, repetition_bit_count:int, original_size:int) -> bytearray:
+    # the original bit-at-a-time decoder, kept here as the baseline to compare against
+    state = {'byte_index': 0, 'bit_buffer': 0, 'bits_in_buffer': 0}
+
+    def read_bits(bit_count:int):
+        if bit_count <= state['bits_in_buffer']:
+            value = state['bit_buffer'] & (2**bit_count - 1)
+            state['bit_buffer'] >>= bit_count
+            state['bits_in_buffer'] -= bit_count
+        else:
+            i = state['byte_index']
+            if i + 3 >= len(buffer):
+                raise ValueError("No more ints to read")
+            new_buffer = int.from_bytes(buffer[i : i + 4], 'big')
+            state['byte_index'] += 4
+
+            new_bits_needed = bit_count - state['bits_in_buffer']
+            value = state['bit_buffer'] << new_bits_needed
+            state['bits_in_buffer'] = 32 - new_bits_needed
+            value |= (new_buffer & (0xffffffff >> state['bits_in_buffer']))
+            state['bit_buffer'] = new_buffer >> new_bits_needed
+        return value
+
+    final_data = bytearray()
+    while len(final_data) < original_size:
+        if read_bits(1) == 0:
+            far_back = read_bits(lookback_bit_count)
+            repetitions = read_bits(repetition_bit_count) + 2
+            if far_back > len(final_data):
+                raise ValueError("Invalid data, received too far lookback")
+            while repetitions != 0:
+                final_data.append(final_data[-1 - far_back])
+                repetitions -= 1
+        else:
+            final_data.append(read_bits(8))
+    return final_data
+
+def synthetic_stream(lookback_bit_count:int, repetition_bit_count:int, size:int, seed:int=0) -> tuple[bytes, int]:
+    # random but valid token stream, roughly the literal/run mix seen in model files
+    rand = random.Random(seed)
+    buffer = ArchiveCompressor.CompressedBufferHelper()
+    written = 0
+    while written < size:
+        if written == 0 or rand.random() < 0.3:
+            buffer.write_original_data(rand.randrange(256))
+            written += 1
+        else:
+            look_back = rand.randrange(min(written, 2**lookback_bit_count))
+            repetitions = rand.randrange(2**repetition_bit_count)
+            buffer.write_repetition(look_back, lookback_bit_count, repetitions, repetition_bit_count)
+            written += repetitions + 2
+    buffer.flush()
+    return bytes(buffer.to_byte_array()), written
+
+def time_decoder(name:str, decoder, total_size:int) -> float:
+    start = time.perf_counter()
+    outputs = decoder()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {total_size / elapsed / 1_000_000:7.2f} MB/s ({elapsed:.2f}s)")
+    return outputs
+
+def benchmark(streams:list[tuple[bytes, int, int, int]]):
+    total_size = sum(x[3] for x in streams)
+    before = time_decoder("before", lambda: [reference_decompress(*x) for x in streams], total_size)
+    after  = time_decoder("after",  lambda: [ArchiveDecompressor(*x).decompress() for x in streams], total_size)
+    assert before == after, "decoders disagree"
+    print(f"{len(streams)} streams, {total_size:,} bytes, outputs identical")
+
+def archive_streams(zzzz_file:str, results_file:str, limit:int) -> list[tuple[bytes, int, int, int]]:
+    with open(results_file, 'r') as f:
+        results = json.load(f)
+    with open(zzzz_file, 'rb') as f:
+        zzzz_dat = f.read()
+
+    streams = []
+    for json_entry in results['GameReferencedCompressedFiles'][:limit]:
+        entry = DataEntry.from_dict(json_entry)
+        if entry.file != zzzz_file:
+            continue
+        these_bytes = zzzz_dat[entry.disk_location : entry.disk_location + entry.compressed_size]
+        streams.append((these_bytes, entry.lookback_bit_size, entry.repetition_bit_size, entry.original_size))
+    return streams
+
+def main():
+    print("Synthetic streams:")
+    streams = []
+    for seed, (lookback, repetition) in enumerate([(11, 4), (14, 5), (12, 4)]):
+        data, size = synthetic_stream(lookback, repetition, 1_000_000, seed)
+        streams.append((data, lookback, repetition, size))
+    benchmark(streams)
+
+    if exists(US_ZZZZ_FILE) and exists(US_RESULTS_FILE):
+        print("US referenced files:")
+        benchmark(archive_streams(US_ZZZZ_FILE, US_RESULTS_FILE, 100))
+
+if __name__ == "__main__": main()
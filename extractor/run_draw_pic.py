@@ -1,14 +1,14 @@
 from PIL import Image
 import json, math
-from helper_mssb_data import DataEntry, MultipleRanges, dirname, ensure_dir
-import progressbar
+import numpy as np
+from helper_mssb_data import dirname, ensure_dir, file_cache
+from helper_sector_map import SectorMap, SECTOR_CATEGORIES
 
 def draw_pic(zzzz_path:str, results_path:str, output_path="found.png"):
     with open(results_path, 'r') as f:
         results = json.load(f)
 
-    with open(zzzz_path, 'rb') as f:
-        data_length = len(f.read())
+    data_length = len(file_cache.get_file_bytes(zzzz_path))
 
     square_size = math.sqrt(data_length//0x800)
 
@@ -17,41 +17,27 @@ def draw_pic(zzzz_path:str, results_path:str, output_path="found.png"):
     else:
         square_size = int(square_size)
 
-    referencedCompressedRanges = MultipleRanges()
-    for entry_json in results['GameReferencedCompressedFiles']:
-        referencedCompressedRanges.add_range(DataEntry.from_dict(entry_json).to_range())
-
-    referencedUncompressedRanges = MultipleRanges()
-    for entry_json in results['GameReferencedRawFiles']:
-        referencedUncompressedRanges.add_range(DataEntry.from_dict(entry_json).to_range())
-
-    unreferencedCompressedRanges= MultipleRanges()
-    for entry_json in results['UnreferencedCompressedFiles']:
-        entry = DataEntry.from_dict(entry_json)
-        unreferencedCompressedRanges.add_range(range(entry.disk_location, entry.disk_location+100))
-
-    adGCRanges = MultipleRanges()
-    for entry_json in results['AdGCForms']:
-        entry = DataEntry.from_dict(entry_json)
-        adGCRanges.add_range(DataEntry.from_dict(entry_json).to_range())
-
-    img = Image.new('RGB', (square_size, square_size), (0,0,0))
+    sector_map = SectorMap.from_results(results, data_length, zzzz_path)
 
     WHITE_PIXEL  = (255, 255, 255)
     CYAN_PIXEL   = (0,255,255)
     ORANGE_PIXEL = (255, 191, 0)
     RED_PIXEL    = (255, 0, 0)
     GREEN_PIXEL  = (0, 255, 0)
+
+    # indexed by sector category
+    palette = np.zeros((SECTOR_CATEGORIES.category_count, 3), np.uint8)
+    palette[SECTOR_CATEGORIES.unknown]      = WHITE_PIXEL
+    palette[SECTOR_CATEGORIES.referenced]   = CYAN_PIXEL
+    palette[SECTOR_CATEGORIES.raw]          = ORANGE_PIXEL
+    palette[SECTOR_CATEGORIES.unreferenced] = RED_PIXEL
+    palette[SECTOR_CATEGORIES.adgcform]     = GREEN_PIXEL
+
     print('Drawing ZZZZ picture...')
-    for i, address in progressbar.progressbar([x for x in enumerate(range(0, data_length, 0x800))]):
-        
-        if   address in referencedCompressedRanges:     pix = CYAN_PIXEL
-        elif address in referencedUncompressedRanges:   pix = ORANGE_PIXEL
-        elif address in unreferencedCompressedRanges:   pix = RED_PIXEL
-        elif address in adGCRanges:                     pix = GREEN_PIXEL
-        else:                                           pix = WHITE_PIXEL
-        
-        img.putpixel((i % square_size, i // square_size), pix)
+    # pixels past the last sector stay black
+    pixels = np.zeros((square_size * square_size, 3), np.uint8)
+    pixels[:len(sector_map)] = palette[sector_map.categories]
+    img = Image.fromarray(pixels.reshape(square_size, square_size, 3), 'RGB')
     
     ensure_dir(dirname(output_path))
 
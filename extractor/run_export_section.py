@@ -0,0 +1,50 @@
+from helper_seek_index import decompress_entry_range
+from helper_results_index import ResultsIndex, load_results_index
+from helper_mssb_data import get_parts_of_file, write_bytes
+from helper_file_system import *
+from os.path import join, exists
+import json
+
+# the part offsets are at the start of the file, this is enough for all of them
+PART_HEADER_SIZE = 0x800
+
+# writes one part of a compressed entry without decompressing the whole entry. The first export of an entry
+# decodes it once and saves a seek index next to results.json, later ones only decode from the checkpoint before the part
+def export_section(results_path:str, zzzz_file:str, output_folder:str, disk_location:int, part_of_file:int) -> str:
+    results_index = load_results_index(results_path)
+    if results_index is None:
+        if not exists(results_path):
+            print(f'{results_path} not found, run main.py first')
+            return None
+        with open(results_path, 'r') as f:
+            results_index = ResultsIndex.from_results(json.load(f))
+
+    results_index = results_index.where(results_index.in_file(zzzz_file))
+    entries = [results_index.entry(i) for i in results_index.at_offset(disk_location)]
+    entries = [x for x in entries if x.lookback_bit_size != 0 and x.original_size != 0]
+    if len(entries) == 0:
+        print(f'No compressed entry of known size at {disk_location:08X}')
+        return None
+    entry = entries[0]
+
+    parts_of_file = get_parts_of_file(decompress_entry_range(entry, results_path, 0, PART_HEADER_SIZE))
+    if part_of_file >= len(parts_of_file):
+        print(f'{disk_location:08X} only has {len(parts_of_file)} parts')
+        return None
+
+    start = parts_of_file[part_of_file]
+    stop = parts_of_file[part_of_file + 1] if part_of_file + 1 < len(parts_of_file) else entry.original_size
+    section = decompress_entry_range(entry, results_path, start, stop)
+
+    output_file_name = join(output_folder, 'Sections', f"{disk_location:08X}", f"{part_of_file}.dat")
+    write_bytes(section, output_file_name)
+    return output_file_name
+
+def main():
+    disk_location = int(input("Input entry location (hex): "), 16)
+    part_of_file = int(input("Input part of file: "))
+    output_file_name = export_section(US_RESULTS_FILE, US_ZZZZ_FILE, US_OUTPUT_FOLDER, disk_location, part_of_file)
+    if output_file_name is not None:
+        print(f'Wrote {output_file_name}')
+
+if __name__ == "__main__": main()
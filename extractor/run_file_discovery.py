@@ -1,11 +1,15 @@
 from os.path import exists, dirname, join
 from os import makedirs
-from helper_mssb_data import DataEntry, FileCache, FingerPrintSearcher, MultipleRanges, ArchiveDecompressor, ensure_dir, write_text, write_bytes
+from helper_mssb_data import DataEntry, DataEntryTable, file_cache, FingerPrintSearcher, MultipleRanges, find_stream_end, ensure_dir, write_text, write_bytes
 import json, progressbar
-from struct import unpack
+import numpy as np
+from bisect import bisect_right
 from helper_file_system import *
-
-file_cache = FileCache()
+from helper_decompression_cache import cached_decompress, cached_is_valid_decompression
+from helper_sector_scan import scan_sectors, first_valid_format
+from helper_sector_map import SectorMap, SECTOR_CATEGORIES
+from helper_ad_gc_form import find_ad_gc_forms
+from helper_discovery_cache import DiscoveryCache, STAMP_KEY, archive_stamp
 
 for file in [US_AAAA_FILE, US_ZZZZ_FILE, US_MAIN_FILE]:
     if not exists(file):
@@ -92,6 +96,9 @@ KNOWN_COMPRESSED_FILES = [
     })
 ]
 
+# (lookback bits, repetition bits, decompressed bytes to check) tried at every unmapped sector of ZZZZ.dat
+BRUTE_FORCE_FORMATS = [(11,4,200)]
+
 def discover_US_files():
     return discover_files(US_MAIN_FILE, US_AAAA_FILE, US_ZZZZ_FILE, US_OUTPUT_FOLDER, KNOWN_RAW_MOVIES, KNOWN_AAAA_FILES + KNOWN_COMPRESSED_FILES, US_RESULTS_FILE)
 
@@ -109,7 +116,7 @@ def discover_family_files():
     return discover_files(FAMILY_MAIN_FILE, FAMILY_AAAA_FILE, FAMILY_ZZZZ_FILE, FAMILY_OUTPUT_FOLDER, [], [], FAMILY_RESULTS_FILE)
 
 
-def discover_files(this_main: str, this_aaaa: str, this_zzzz: str, this_output_folder: str, this_verified_raw_files:list[DataEntry], this_verified_compressed_files:list[DataEntry], output_file: str):
+def discover_files(this_main: str, this_aaaa: str, this_zzzz: str, this_output_folder: str, this_verified_raw_files:list[DataEntry], this_verified_compressed_files:list[DataEntry], output_file: str, formats_to_search:list[tuple[int, int, int]]=BRUTE_FORCE_FORMATS):
     if any([not exists(x) for x in [this_zzzz, this_aaaa, this_main]]):
         return
 
@@ -119,14 +126,23 @@ def discover_files(this_main: str, this_aaaa: str, this_zzzz: str, this_output_f
     this_aaaa_dat = file_cache.get_file_bytes(this_aaaa)
     this_main_dol = file_cache.get_file_bytes(this_main)
 
-    b1 = 11
-    b2 = 4
-    size = 200    
+    # every stage is cached against the archives it read, so only stages whose inputs changed rerun
+    cache = DiscoveryCache(join(this_output_folder, NAME_FOLDER_DISCOVERY_CACHE))
+    stamp = archive_stamp([this_main, this_aaaa, this_zzzz])
+    main_hash, aaaa_hash, zzzz_hash = stamp[this_main], stamp[this_aaaa], stamp[this_zzzz]
+
+    known_raw = [x.to_dict() for x in this_verified_raw_files]
+    known_compressed = [x.to_dict() for x in this_verified_compressed_files]
 
-    unverified_aaaa_decompressions = []
-    print(f'Doing brute force decompression check ({b1} {b2})...')
-    for i in progressbar.progressbar(range(0, len(this_aaaa_dat), 0x800)):
-        if ArchiveDecompressor(this_aaaa_dat[i : i + 2*size], b1, b2, size).is_valid_decompression():
+    def find_rels() -> list[dict]:
+        b1 = 11
+        b2 = 4
+        size = 200    
+
+        unverified_aaaa_decompressions = []
+        print(f'Doing brute force decompression check ({b1} {b2})...')
+        sector_offsets = np.arange(0, len(this_aaaa_dat), 0x800)
+        for i in sector_offsets[scan_sectors(this_aaaa, sector_offsets, [(b1, b2, size)])[0]].tolist():
             unverified_aaaa_decompressions.append(DataEntry.from_dict({
                 "Input": this_aaaa,
                 "lookbackBitSize": b1,
@@ -137,20 +153,29 @@ def discover_files(this_main: str, this_aaaa: str, this_zzzz: str, this_output_f
                 "compressionFlag": 0,
             }))
 
-    main_search_results = FingerPrintSearcher(this_main_dol, this_aaaa).search_compression(b1, b2)
-    
-    rels = []
-    list_found_main_entries = list(main_search_results)
-    for entry in unverified_aaaa_decompressions:
-        matching_offsets = [x for x in list_found_main_entries if x.disk_location == entry.disk_location]
+        main_search_results = FingerPrintSearcher(this_main_dol, this_aaaa).search_compression(b1, b2)
+        
+        rels = []
+        list_found_main_entries = list(main_search_results)
+        for entry in unverified_aaaa_decompressions:
+            matching_offsets = [x for x in list_found_main_entries if x.disk_location == entry.disk_location]
+
+            assert(len(matching_offsets) in [0, 1])
+
+            if len(matching_offsets) > 0:
+                for r in matching_offsets:
+                    r: DataEntry
+                    if is_decompression_valid(r):
+                        rels.append(r)
+
+        # aaaa.dat changed, any rels written before are stale
+        for rel in rels:
+            write_bytes(decompress(rel), join(this_output_folder, f'{rel.disk_location:x}.rel'))
 
-        assert(len(matching_offsets) in [0, 1])
+        return [x.to_dict() for x in rels]
 
-        if len(matching_offsets) > 0:
-            for r in matching_offsets:
-                r: DataEntry
-                if is_decompression_valid(r):
-                    rels.append(r)
+    rels_key = cache.key('rels', main_hash, aaaa_hash, this_output_folder)
+    rels = [DataEntry.from_dict(x) for x in cache.run('rels', rels_key, find_rels)]
 
     rels_to_search = [this_main]
     for rel in rels:
@@ -159,64 +184,66 @@ def discover_files(this_main: str, this_aaaa: str, this_zzzz: str, this_output_f
 
         if not exists(rel_output_path):
             write_bytes(decompress(rel), rel_output_path)
-    
-    main_search_results: set[DataEntry] = set()
-    found_raw_entries:set[DataEntry] = set()
 
-    # start mapping out all files
-    verified_entries:list[DataEntry] = list()
-    verified_entries.extend(this_verified_compressed_files)
+    def search_fingerprints() -> dict:
+        compressed_tables:list[DataEntryTable] = []
+        raw_tables:list[DataEntryTable] = []
 
-    verified_raw_entries:list[DataEntry] = list()
-    verified_raw_entries.extend(this_verified_raw_files)
+        # accumulate all entries that look like a decompression fingerprint
+        print("Searching rels...")
+        for rel in progressbar.progressbar(rels_to_search):
+            compressed_entries, raw_entries = FingerPrintSearcher(file_cache.get_file_bytes(rel), this_zzzz).search_tables([(11, 4)])
+            compressed_tables.append(compressed_entries)
+            raw_tables.append(raw_entries)
 
-    # accumulate all entries that look like a decompression fingerprint
-    print("Searching rels...")
-    for rel in progressbar.progressbar(rels_to_search):
-        searcher = FingerPrintSearcher(file_cache.get_file_bytes(rel), this_zzzz)
-        main_search_results.update(searcher.search_compression(11, 4))
-        found_raw_entries.update(searcher.search_uncompressed())
+        found_entries = DataEntryTable.concatenate(compressed_tables).unique()
+        # remove ones that look like the aaaa.dat files
+        found_entries = found_entries[~found_entries.isin(DataEntryTable.from_entries(rels))]
+        list_entries = found_entries.entries()
 
-    list_entries = list(main_search_results)
-    list_entries.sort(key=lambda x: x.disk_location)
-    # remove ones that look like the aaaa.dat files
-    for rel in rels:
-        rel: DataEntry
+        list_raw_entries = DataEntryTable.concatenate(raw_tables).unique().entries()
 
-        list_entries = [x for x in list_entries if not rel.equals_besides_filename(x)]
+        # check new entries
+        verified_entries:list[DataEntry] = list()
+        print('verifying found compressed data...')
+        for new_entry in progressbar.progressbar(list_entries):
+            new_entry:DataEntry
 
-    list_raw_entries = list(found_raw_entries)
-    list_raw_entries.sort(key=lambda x: x.disk_location)
+            if is_decompression_valid(new_entry):
+                new_entry.output_name = join(OUTPUT_FOLDER, "cmp " + new_entry.output_name.strip(US_ZZZZ_FILE))
+                verified_entries.append(new_entry)
 
-    # start mapping file    
-    file_mapping = MultipleRanges()
+        return {
+            'Compressed': [x.to_dict() for x in verified_entries],
+            'Raw': [x.to_dict() for x in list_raw_entries],
+        }
 
-    for known_file in this_verified_raw_files:
-        known_file: DataEntry
+    fingerprints_key = cache.key('fingerprints', rels_key, zzzz_hash, this_zzzz)
+    fingerprints = cache.run('fingerprints', fingerprints_key, search_fingerprints)
 
-        verified_raw_entries.append(known_file)
-        file_mapping.add_range(known_file.to_range())
+    verified_entries:list[DataEntry] = list()
+    verified_entries.extend(this_verified_compressed_files)
+    verified_entries.extend(DataEntry.from_dict(x) for x in fingerprints['Compressed'])
 
-    # check new entries
-    print('verifying found compressed data...')
-    for new_entry in progressbar.progressbar(list_entries):
-        new_entry:DataEntry
-        entry_range = new_entry.to_range()
+    def brute_force() -> dict:
+        # sector level view of everything found so far, the brute force search only looks at sectors nothing claims yet
+        sector_map = SectorMap(len(this_zzzz_dat))
+        sector_map.mark_ranges([x.disk_location for x in this_verified_raw_files], [x.to_range().stop for x in this_verified_raw_files], SECTOR_CATEGORIES.raw)
+        for entry in verified_entries[len(this_verified_compressed_files):]:
+            sector_map.mark_range(entry.to_range(), SECTOR_CATEGORIES.referenced)
 
-        if is_decompression_valid(new_entry):
-            new_entry.output_name = join(OUTPUT_FOLDER, "cmp " + new_entry.output_name.strip(US_ZZZZ_FILE))
-            verified_entries.append(new_entry)
-            file_mapping.add_range(entry_range)
-    
-    unverified_aaaa_decompressions:list[DataEntry] = list()
+        unverified_aaaa_decompressions:list[DataEntry] = list()
+        claimed_ranges = []
 
-    formats_to_search = [(11,4,200)]
-    for b1, b2, size in formats_to_search:
-        print(f'Doing brute force decompression check ({b1} {b2})...')
-        for i in progressbar.progressbar(range(0, len(this_zzzz_dat), 0x800)):
-            if i in file_mapping:
-                continue
-            if ArchiveDecompressor(this_zzzz_dat[i:i+2*size], b1, b2, size).is_valid_decompression():
+        print(f'Doing brute force decompression check ({", ".join(f"{b1} {b2}" for b1, b2, _ in formats_to_search)})...')
+        sector_offsets = sector_map.unmapped_sector_offsets()
+        valid_formats = scan_sectors(this_zzzz, sector_offsets, formats_to_search)
+
+        for (b1, b2, size), format_valid in zip(formats_to_search, valid_formats):
+            print(f'{b1} {b2}: {np.count_nonzero(format_valid)} sectors validate')
+
+        for (b1, b2, size), format_valid in zip(formats_to_search, first_valid_format(valid_formats)):
+            for i in sector_offsets[format_valid].tolist():
                 unverified_aaaa_decompressions.append(DataEntry.from_dict({
                     "Input": this_zzzz,
                     "Output": join(this_output_folder, f"cmp unverified {i:x}.dat"),
@@ -227,76 +254,55 @@ def discover_files(this_main: str, this_aaaa: str, this_zzzz: str, this_output_f
                     "compressedSize": 0,
                     "compressionFlag": 0,
                 }))
-                file_mapping.add_range(range(i, i+size))
-    
-    ad_gc_search = this_zzzz_dat[:]
-    adgcform = b'AdGCForm'
-    ind = ad_gc_search.find(adgcform)
-    ad_gc_forms:list[DataEntry] = []
-    offset = 0
-    found_form_count = ad_gc_search.count(adgcform)
-    print(f'Verifying AdGCForms...')
-    bar = progressbar.ProgressBar(0, found_form_count)
-    bar.start()
-    form_i = 0
-    while ind != -1:
-        data_begins = ind + len(adgcform)
-        this_adgc_form_location = data_begins + offset
-        
-        finger_print = ad_gc_search[ind-8:ind]
-        
-        original_size, compression_info = unpack('<II', finger_print)
-        compressed_flag = original_size >> 28
-        original_size &= 0xfffffff
-
-
-        if compressed_flag == 0:
-            lookback_bit = 0
-            repetition_bit = 0
-            compressed_size = original_size
-        else:
-            lookback_bit = compression_info & 0xff
-            repetition_bit = (compression_info >> 8) & 0xff
-
-            decompressor = ArchiveDecompressor(this_zzzz_dat[this_adgc_form_location:], lookback_bit, repetition_bit, original_size)
-            decompressor.decompress()
-
-            compressed_size = decompressor.compressed_size
-
-        ad_gc_forms.append(DataEntry.from_dict({
-                "Input": this_zzzz,
-                "Output": join(this_output_folder, f"AdGCForm {this_adgc_form_location:08x}.dat"),
-                "lookbackBitSize": lookback_bit,
-                "repetitionBitSize": repetition_bit,
-                "size": original_size,
-                "offset": this_adgc_form_location,
-                "compressedSize": compressed_size,
-                "compressionFlag": compressed_flag,
-        }))
-
-        new_ad_gc_search = ad_gc_search[ind+len(adgcform):]
-        removed_space = len(ad_gc_search) - len(new_ad_gc_search)
-        offset += removed_space
-
-        ad_gc_search = new_ad_gc_search
-        ind = ad_gc_search.find(adgcform)
-        form_i += 1
-        bar.update(form_i)
-    bar.finish()
-
-    print('Verifying found raw data...')
-    for new_entry in progressbar.progressbar(list_raw_entries):
-        
-        new_entry:DataEntry
-        entry_range = new_entry.to_range()
-        # if the proposed range overlaps with previous entries, skip
-        if file_mapping.does_overlap(entry_range):
-            continue
+                claimed_ranges.append([i, i+size])
+
+        return {
+            'Entries': [x.to_dict() for x in unverified_aaaa_decompressions],
+            'Claimed': claimed_ranges,
+        }
+
+    brute_force_key = cache.key('brute force', fingerprints_key, known_raw, formats_to_search, this_output_folder)
+    brute_force_results = cache.run('brute force', brute_force_key, brute_force)
+    unverified_aaaa_decompressions = [DataEntry.from_dict(x) for x in brute_force_results['Entries']]
+
+    def verify_ad_gc_forms() -> list[dict]:
+        print(f'Verifying AdGCForms...')
+        return [x.to_dict() for x in find_ad_gc_forms(this_zzzz, this_output_folder)]
+
+    ad_gc_forms_key = cache.key('AdGCForms', zzzz_hash, this_zzzz, this_output_folder)
+    ad_gc_forms = [DataEntry.from_dict(x) for x in cache.run('AdGCForms', ad_gc_forms_key, verify_ad_gc_forms)]
+
+    def verify_raw() -> list[dict]:
+        # start mapping file
+        file_mapping = MultipleRanges.from_ranges([x.to_range() for x in this_verified_raw_files] + [x.to_range() for x in verified_entries[len(this_verified_compressed_files):]] + [range(*x) for x in brute_force_results['Claimed']])
+
+        # most candidates overlap something found before this stage, those are dropped together
+        candidates = DataEntryTable.from_entries([DataEntry.from_dict(x) for x in fingerprints['Raw']])
+        candidates = candidates[~candidates.overlaps(file_mapping)]
+
+        verified_raw_entries:list[DataEntry] = list()
+        print('Verifying found raw data...')
+        for new_entry in progressbar.progressbar(candidates.entries()):
+            
+            new_entry:DataEntry
+            entry_range = new_entry.to_range()
+            # if the proposed range overlaps with previous entries, skip
+            if file_mapping.does_overlap(entry_range):
+                continue
 
-        # if is_decompression_valid(new_entry):
-        new_entry.output_name = join(this_output_folder, "raw " + new_entry.output_name.strip(this_zzzz))
-        verified_raw_entries.append(new_entry)
-        file_mapping.add_range(new_entry.to_range())
+            # if is_decompression_valid(new_entry):
+            new_entry.output_name = join(this_output_folder, "raw " + new_entry.output_name.strip(this_zzzz))
+            verified_raw_entries.append(new_entry)
+            file_mapping.add_range(new_entry.to_range())
+
+        return [x.to_dict() for x in verified_raw_entries]
+
+    raw_key = cache.key('raw', brute_force_key, this_output_folder)
+    verified_raw_entries:list[DataEntry] = list()
+    verified_raw_entries.extend(this_verified_raw_files)
+    # the known files have always gone in twice, kept so results.json reads the same as before
+    verified_raw_entries.extend(this_verified_raw_files)
+    verified_raw_entries.extend(DataEntry.from_dict(x) for x in cache.run('raw', raw_key, verify_raw))
 
     output = {
         'GameReferencedCompressedFiles': [x.to_dict() for x in verified_entries],
@@ -304,17 +310,43 @@ def discover_files(this_main: str, this_aaaa: str, this_zzzz: str, this_output_f
         'UnreferencedCompressedFiles': [x.to_dict() for x in unverified_aaaa_decompressions],
         'AdGCForms': [x.to_dict() for x in ad_gc_forms],
     }
+
+    def resolve_sizes() -> list[dict]:
+        print('Finding the end of unreferenced compressed data...')
+        return resolve_unreferenced_sizes(output, this_zzzz)['UnreferencedCompressedFiles']
+
+    sizes_key = cache.key('unreferenced sizes', raw_key, ad_gc_forms_key, known_compressed)
+    output['UnreferencedCompressedFiles'] = cache.run('unreferenced sizes', sizes_key, resolve_sizes)
+    output[STAMP_KEY] = stamp
     
     with open(output_file, "w") as f:
         json.dump(output, f, indent=2)
     
     return output
 
+def resolve_unreferenced_sizes(results:dict, zzzz_file:str) -> dict:
+    # unreferenced streams aren't in any offset table, so their sizes come from where each one stops.
+    # The next entry found after a stream is as far as it can go
+    zzzz_dat = file_cache.get_file_bytes(zzzz_file)
+    entries = {k: [DataEntry.from_dict(x) for x in results[k]] for k in ['GameReferencedCompressedFiles', 'GameReferencedRawFiles', 'UnreferencedCompressedFiles', 'AdGCForms'] if k in results}
+
+    starts = [x.disk_location for k in ['GameReferencedCompressedFiles', 'GameReferencedRawFiles', 'UnreferencedCompressedFiles'] for x in entries.get(k, []) if x.file == zzzz_file]
+    # AdGCForm entries start after their 8 byte size header and the AdGCForm marker
+    starts += [x.disk_location - 16 for x in entries.get('AdGCForms', []) if x.file == zzzz_file]
+    starts = sorted(set(starts))
+
+    for entry in progressbar.progressbar(entries['UnreferencedCompressedFiles']):
+        if entry.file == zzzz_file and entry.compressed_size == 0:
+            i = bisect_right(starts, entry.disk_location)
+            end = starts[i] if i < len(starts) else len(zzzz_dat)
+            entry.compressed_size, entry.original_size = find_stream_end(zzzz_dat, entry.lookback_bit_size, entry.repetition_bit_size, entry.disk_location, end)
+
+    results['UnreferencedCompressedFiles'] = [x.to_dict() for x in entries['UnreferencedCompressedFiles']]
+    return results
+
 def is_decompression_valid(d: DataEntry) -> bool:
-    byte_data = file_cache.get_file_bytes(d.file)[d.disk_location : d.disk_location+d.compressed_size]
-    return ArchiveDecompressor(byte_data, d.lookback_bit_size, d.repetition_bit_size).is_valid_decompression()
+    return cached_is_valid_decompression(d.file, d.lookback_bit_size, d.repetition_bit_size, None, d.disk_location, d.disk_location+d.compressed_size)
 
 
 def decompress(d: DataEntry) -> bytearray:
-    byte_data = file_cache.get_file_bytes(d.file)[d.disk_location : d.disk_location+d.compressed_size]
-    return ArchiveDecompressor(byte_data, d.lookback_bit_size, d.repetition_bit_size).decompress()
+    return cached_decompress(d.file, d.lookback_bit_size, d.repetition_bit_size, None, d.disk_location, d.disk_location+d.compressed_size)
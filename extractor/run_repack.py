@@ -0,0 +1,36 @@
+from helper_repack import ArchiveRepacker
+from helper_file_system import *
+from os.path import exists
+
+# put edited files, named {location:08X}.dat like the extracted ones, in the region's 'Modified files' folder.
+# The patched main.dol, aaaa.dat and ZZZZ.dat are written to the region's 'Repacked' folder
+def repack_version(main_file:str, aaaa_file:str, zzzz_file:str, results_path:str, modified_folder:str, repack_folder:str, search_bit_sizes:bool=False):
+    if any([not exists(x) for x in [main_file, aaaa_file, zzzz_file, results_path, modified_folder]]):
+        return []
+
+    return ArchiveRepacker(main_file, aaaa_file, zzzz_file, results_path, repack_folder, search_bit_sizes).repack(modified_folder)
+
+def repack_US():
+    print('Repacking US files...')
+    return repack_version(US_MAIN_FILE, US_AAAA_FILE, US_ZZZZ_FILE, US_RESULTS_FILE, US_MODIFIED_FOLDER, US_REPACK_FOLDER)
+def repack_JP():
+    print('Repacking JP files...')
+    return repack_version(JP_MAIN_FILE, JP_AAAA_FILE, JP_ZZZZ_FILE, JP_RESULTS_FILE, JP_MODIFIED_FOLDER, JP_REPACK_FOLDER)
+def repack_EU():
+    print('Repacking EU files...')
+    return repack_version(EU_MAIN_FILE, EU_AAAA_FILE, EU_ZZZZ_FILE, EU_RESULTS_FILE, EU_MODIFIED_FOLDER, EU_REPACK_FOLDER)
+def repack_BETA():
+    print('Repacking Beta files...')
+    return repack_version(BETA_MAIN_FILE, BETA_AAAA_FILE, BETA_ZZZZ_FILE, BETA_RESULTS_FILE, BETA_MODIFIED_FOLDER, BETA_REPACK_FOLDER)
+def repack_family():
+    print('Repacking family files...')
+    return repack_version(FAMILY_MAIN_FILE, FAMILY_AAAA_FILE, FAMILY_ZZZZ_FILE, FAMILY_RESULTS_FILE, FAMILY_MODIFIED_FOLDER, FAMILY_REPACK_FOLDER)
+
+def main():
+    repack_US()
+    repack_JP()
+    repack_EU()
+    repack_BETA()
+    repack_family()
+
+if __name__ == "__main__": main()